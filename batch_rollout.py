@@ -0,0 +1,60 @@
+"""
+Plays many random games of ultimate tic-tac-toe at once on NumPy arrays.
+
+The games are held as the (cells, status, forced, player, result) arrays of
+ultimate_tictactoe.batch_board, and every ply advances all unfinished games
+together.
+"""
+
+import numpy as np
+
+from ultimate_tictactoe.batch_board import legal_masks, play_moves
+
+
+def from_board(board, player, k):
+    """
+    Returns k copies of the position on board, with player to move, as the
+    (cells, status, forced, player, result) arrays of a batch.
+    """
+    cells = np.array([subboard.board_status for subboard in board.boards], np.int8)
+    status = np.array(board.board_status, np.int8)
+    forced = board.prev_move[1]
+    if forced != -1 and status[forced] != 0:
+        forced = -1
+    return (
+        np.tile(cells.reshape(81), (k, 1)),
+        np.tile(status, (k, 1)),
+        np.full(k, forced),
+        np.full(k, player, np.int8),
+        np.full(k, board.won, np.int8),
+    )
+
+
+def random_playouts(board, player, k, want_to_win):
+    """
+    Plays k random games to the end from the position on board, with player
+    to move, without changing board.
+    Returns how many of them want_to_win won, drew and lost, and the number
+    of moves played in all of them.
+    """
+    cells, status, forced, players, result = from_board(board, player, k)
+    playing = np.flatnonzero(result == 0)
+    plies = 0
+    while len(playing):
+        plies += len(playing)
+        g_cells, g_status = cells[playing], status[playing]
+        g_players = players[playing]
+        legal = legal_masks(g_cells, g_status, forced[playing])
+        # a uniformly random legal move: the legal spot with the highest key
+        keys = np.where(legal, np.random.random_sample(legal.shape), -1.0)
+        moves = np.argmax(keys, axis=1)
+        g_forced, g_result = play_moves(g_cells, g_status, g_players, moves)
+        cells[playing], status[playing] = g_cells, g_status
+        forced[playing] = g_forced
+        result[playing] = g_result
+        players[playing] = 3 - g_players
+        playing = playing[g_result == 0]
+
+    wins = int(np.count_nonzero(result == want_to_win))
+    draws = int(np.count_nonzero(result == -1))
+    return wins, draws, k - wins - draws, plies
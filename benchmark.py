@@ -0,0 +1,471 @@
+"""
+Benchmarks for the game engines, the search, the envs and the network.
+
+    python benchmark.py [workload ...] [--output FILE] [--baseline FILE]
+
+runs the named workloads (all of them by default) and prints what each
+measured. Every workload is seeded, so it does the same work on every run.
+Metrics ending in _per_s are rates (higher is better) and the others are
+times (lower is better). --output saves the results as JSON, and --baseline
+compares them with results saved earlier, failing if any metric got worse by
+more than --tolerance. Workloads whose dependencies (gym and PettingZoo for
+the env, TensorFlow as well for the network) are missing are skipped.
+
+The startup workload times how long a fresh interpreter takes to import each
+entry point, and fails if importing one of them loads a heavy dependency,
+which should only be imported once an env or a network is made.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SEED = 4701
+
+# dependencies that take seconds to import
+HEAVY = ("tensorflow", "gym", "pettingzoo")
+# entry points that must import with only NumPy
+LIGHT = (
+    "board",
+    "monte_carlo",
+    "game",
+    "simulate",
+    "ultimate_tictactoe_v1",
+    "neutralnet",
+    "selfplay",
+)
+
+_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def startup_time(module, repeat=3):
+    """
+    Imports module in repeat fresh interpreters. Returns the best import time
+    and the best time for the whole process, in seconds, and the heavy
+    dependencies the import loaded.
+    """
+    code = _IMPORT.format(module=module, heavy=HEAVY)
+    best_import = best_process = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        best_process = min(best_process, time.perf_counter() - start)
+        seconds, loaded = json.loads(out.stdout.splitlines()[-1])
+        best_import = min(best_import, seconds)
+    return best_import, best_process, loaded
+
+
+def benchmark_startup(modules=LIGHT, repeat=3):
+    """
+    Returns {module: {"import_s", "process_s", "heavy"}} for each module.
+    """
+    results = {}
+    for module in modules:
+        import_s, process_s, loaded = startup_time(module, repeat)
+        results[module] = {
+            "import_s": import_s,
+            "process_s": process_s,
+            "heavy": loaded,
+        }
+    return results
+
+
+def _seed():
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+
+def _timed(fn, repeat=3):
+    """
+    Returns the best time in seconds of repeat calls to fn, each starting
+    from the same seed.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        _seed()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _random_games(n):
+    """
+    Returns the moves of n seeded random games, as lists of (big, small).
+    """
+    from board import BigBoard, Board
+
+    rng = random.Random(SEED)
+    games = []
+    for _ in range(n):
+        board = BigBoard([Board() for _ in range(9)])
+        moves = []
+        while not board.is_game_over():
+            move = rng.choice(board.get_legal_actions())
+            board.push(move)
+            moves.append(move)
+        games.append(moves)
+    return games
+
+
+def _positions(games):
+    """
+    Returns a board for every position reached in games.
+    """
+    from board import BigBoard, Board
+
+    boards = []
+    for moves in games:
+        for ply in range(len(moves)):
+            board = BigBoard([Board() for _ in range(9)])
+            for move in moves[:ply]:
+                board.push(move)
+            boards.append(board)
+    return boards
+
+
+def _observations(n, plies=12):
+    """
+    Returns the (n, 9, 9, 2) observations and (n, 81) action masks of n games
+    played plies random moves into.
+    """
+    from ultimate_tictactoe.vector_env import VectorEnv
+
+    rng = np.random.RandomState(SEED)
+    vector_env = VectorEnv(n)
+    observation, mask = vector_env.reset()
+    for _ in range(plies):
+        keys = np.where(mask, rng.random_sample(mask.shape), -1.0)
+        observation, mask, _, _ = vector_env.step(np.argmax(keys, axis=1))
+    return observation, mask
+
+
+def _states(games):
+    """
+    Returns a State for the position after each move of games but the last.
+    """
+    from selfplay import State
+    from ultimate_tictactoe.ultimate_tictactoe import raw_env
+
+    states = []
+    for moves in games:
+        env = raw_env()
+        env.reset()
+        for big, small in moves[:-1]:
+            env.step(big * 9 + small)
+            states.append(State(env.clone()))
+    return states
+
+
+def bench_startup():
+    results = {}
+    heavy = []
+    for module, result in benchmark_startup().items():
+        results[module + "_import_ms"] = result["import_s"] * 1000
+        results[module + "_process_ms"] = result["process_s"] * 1000
+        heavy.extend(module + " loads " + name for name in result["heavy"])
+    results["heavy"] = heavy
+    return results
+
+
+def bench_board():
+    from board import Board
+
+    rng = random.Random(SEED)
+    games = [rng.sample(range(9), 9) for _ in range(20000)]
+
+    def make_moves():
+        moves = 0
+        for spots in games:
+            board = Board()
+            player = 1
+            for spot in spots:
+                _, won, drawn = board.make_move(player, spot)
+                moves += 1
+                if won or drawn:
+                    break
+                player = 3 - player
+        return moves
+
+    boards = []
+    for spots in games:
+        board = Board()
+        for i, spot in enumerate(spots[:6]):
+            board.masks[i % 2] |= 1 << spot
+        boards.append(board)
+
+    def check_won():
+        for board in boards:
+            board.check_won()
+
+    moves = make_moves()
+    return {
+        "make_move_per_s": moves / _timed(make_moves),
+        "check_won_per_s": len(boards) / _timed(check_won),
+    }
+
+
+def bench_legal_actions():
+    boards = _positions(_random_games(50))
+
+    def legal_actions():
+        for board in boards:
+            for _ in range(10):
+                board.get_legal_actions()
+
+    return {"get_legal_actions_per_s": 10 * len(boards) / _timed(legal_actions)}
+
+
+def bench_playouts():
+    from batch_rollout import random_playouts
+    from game import create_board
+    from monte_carlo import MCTSTree
+
+    board = create_board()
+    tree = MCTSTree(1, 1)
+    n = 200
+
+    def playouts():
+        for _ in range(n):
+            tree.rollout(board, 1)
+
+    k = 256
+
+    def batched():
+        for _ in range(10):
+            random_playouts(board, 1, k, 1)
+
+    return {
+        "playouts_per_s": n / _timed(playouts),
+        "batched_playouts_per_s": 10 * k / _timed(batched),
+    }
+
+
+def bench_mcts():
+    from board import BigBoard, Board
+    from monte_carlo import MCTSNode
+
+    opening = BigBoard([Board() for _ in range(9)])
+    middle = _positions(_random_games(1))[20]
+    n = 1000
+    results = {}
+    for name, board in (("opening", opening), ("middle", middle)):
+        player = board.next_player()
+
+        def search():
+            MCTSNode(board, player, player).best_action(simulations=n)
+
+        results[name + "_simulations_per_s"] = n / _timed(search)
+    return results
+
+
+def bench_env():
+    from ultimate_tictactoe.ultimate_tictactoe import raw_env
+
+    games = [[big * 9 + small for big, small in moves] for moves in _random_games(20)]
+    env = raw_env()
+    steps = sum(map(len, games))
+
+    def play(observe):
+        for actions in games:
+            env.reset()
+            for action in actions:
+                env.step(action)
+                if observe:
+                    env.observe(env.agent_selection)
+
+    return {
+        "steps_per_s": steps / _timed(lambda: play(False)),
+        "step_observe_per_s": steps / _timed(lambda: play(True)),
+    }
+
+
+def bench_vector_env():
+    from ultimate_tictactoe.vector_env import VectorEnv
+
+    vector_env = VectorEnv(256)
+    n = 400
+
+    def play():
+        rng = np.random.RandomState(SEED)
+        _, mask = vector_env.reset()
+        for _ in range(n):
+            keys = np.where(mask, rng.random_sample(mask.shape), -1.0)
+            _, mask, _, _ = vector_env.step(np.argmax(keys, axis=1))
+
+    return {"game_steps_per_s": vector_env.num_envs * n / _timed(play)}
+
+
+def bench_nnet():
+    from neutralnet import NNet
+
+    states = _states(_random_games(2))
+    # the model summary printed on creation would clutter the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        nnet = NNet(81)
+        cached = NNet(81, cache_size=len(states))
+    cached.nnet.set_weights(nnet.nnet.get_weights())
+    for state in states:
+        cached.predict(state)
+    observation, mask = _observations(256)
+    nnet.predict_batch(observation, mask)
+
+    def single(nnet):
+        for state in states:
+            nnet.predict(state)
+
+    def batched():
+        for _ in range(10):
+            nnet.predict_batch(observation, mask)
+
+    return {
+        "predict_us": _timed(lambda: single(nnet)) / len(states) * 1e6,
+        "predict_cached_us": _timed(lambda: single(cached)) / len(states) * 1e6,
+        "batched_positions_per_s": 10 * len(observation) / _timed(batched),
+    }
+
+
+def bench_next_state():
+    from selfplay import State
+    from ultimate_tictactoe.ultimate_tictactoe import raw_env
+
+    states = []
+    for moves in _random_games(5):
+        env = raw_env()
+        env.reset()
+        for big, small in moves[: len(moves) // 2]:
+            env.step(big * 9 + small)
+        states.append(State(env))
+    branches = sum(len(state.getValidActions()) for state in states)
+
+    def expand():
+        for state in states:
+            for action in state.getValidActions():
+                state.nextState(action)
+
+    return {"next_state_us": _timed(expand) / branches * 1e6}
+
+
+WORKLOADS = {
+    "startup": bench_startup,
+    "board": bench_board,
+    "legal_actions": bench_legal_actions,
+    "playouts": bench_playouts,
+    "mcts": bench_mcts,
+    "env": bench_env,
+    "vector_env": bench_vector_env,
+    "nnet": bench_nnet,
+    "next_state": bench_next_state,
+}
+
+
+def run(names=None):
+    """
+    Runs the named workloads (all by default). Returns {name: metrics}, with
+    the metrics of a workload whose dependencies are missing replaced by
+    {"skipped": reason}.
+    """
+    results = {}
+    for name in names or WORKLOADS:
+        try:
+            results[name] = WORKLOADS[name]()
+        except ImportError as e:
+            results[name] = {"skipped": str(e)}
+    return results
+
+
+def compare(baseline, results, tolerance=0.15):
+    """
+    Returns (workload, metric, baseline value, new value, change) for every
+    metric found in both results, change being the relative improvement
+    (negative if it got worse), and the ones that got worse by more than
+    tolerance.
+    """
+    rows = []
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            if metric.endswith("_per_s"):
+                change = value / old - 1
+            else:
+                change = old / value - 1
+            row = (name, metric, old, value, change)
+            rows.append(row)
+            if change < -tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("workloads", nargs="*", help=", ".join(WORKLOADS))
+    parser.add_argument("--output", help="file to save the results to, as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error("unknown workloads: " + ", ".join(sorted(unknown)))
+
+    results = run(args.workloads)
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            if isinstance(value, float):
+                value = "{:,.1f}".format(value)
+            elif isinstance(value, list):
+                value = ", ".join(value) or "-"
+            print("{:<14} {:<32} {}".format(name, metric, value))
+
+    failed = bool(results.get("startup", {}).get("heavy"))
+    if args.output:
+        with open(args.output, "w") as f:
+            output = {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "results": results,
+            }
+            json.dump(output, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        rows, regressions = compare(baseline, results, args.tolerance)
+        print()
+        for name, metric, old, new, change in rows:
+            print(
+                "{:<14} {:<32} {:>14,.1f} -> {:>14,.1f}  {:+.0%}".format(
+                    name, metric, old, new, change
+                )
+            )
+        for name, metric, _, _, change in regressions:
+            print("regression: {} {} {:+.0%}".format(name, metric, change))
+        failed |= bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,7 @@
-class InvalidMove:
+import random
+
+
+class InvalidMove(Exception):
     def __init__(self, *args):
         if args:
             self.message = args[0]
@@ -12,14 +15,54 @@ class InvalidMove:
             return "Invalid move played"
 
 
+# Boards are stored as 9-bit masks, bit i standing for spot i (see the Board
+# docstring for the numbering).
+FULL = 0b111111111
+ROWS = (0b000000111, 0b000111000, 0b111000000)
+COLUMNS = (0b001001001, 0b010010010, 0b100100100)
+DIAGS = (0b100010001, 0b001010100)
+
+# WINNING[mask] is True iff the spots in mask contain a full row, column or
+# diagonal, so win detection is a single table lookup
+WINNING = tuple(
+    any(mask & line == line for line in ROWS + COLUMNS + DIAGS)
+    for mask in range(FULL + 1)
+)
+
+# SPOTS[mask] is the tuple of spots set in mask, in increasing order
+SPOTS = tuple(tuple(i for i in range(9) if mask >> i & 1) for mask in range(FULL + 1))
+
+# Moves across the big board are kept as 81-bit masks, bit big * 9 + small
+# standing for move (big, small). SUBBOARD_BITS[big] covers subboard big, and
+# MOVES[big][mask] is the tuple of moves (big, small) for the spots in mask.
+SUBBOARD_BITS = tuple(FULL << 9 * big for big in range(9))
+MOVES = tuple(
+    tuple(tuple((big, small) for small in SPOTS[mask]) for mask in range(FULL + 1))
+    for big in range(9)
+)
+
+# Random 64-bit keys for Zobrist hashing of BigBoard positions: one per player
+# per spot (indexed big * 9 + small), one per subboard the next move is forced
+# into (indexed forced + 1, so -1 is "any") and one for player 2 being to move.
+# They are seeded so that hashes agree across processes and runs.
+_random_key = random.Random(0x5EED).getrandbits
+CELL_KEYS = tuple(tuple(_random_key(64) for _ in range(81)) for _ in range(2))
+FORCED_KEYS = tuple(_random_key(64) for _ in range(10))
+SIDE_KEY = _random_key(64)
+
+
 class Board(object):
     """
     A class used to represent a normal tic-tac-toe board
 
     Attributes
     ----------
+    masks : int list
+        two 9-bit masks, masks[player - 1] having bit i set iff player has
+        taken spot i
     board_status : int list
-        a list of ints representing a flattened out tic-tac-toe board
+        a list of ints representing a flattened out tic-tac-toe board, built
+        from masks on access
         visually:
                 0 | 1 | 2
                 ---------
@@ -43,82 +86,75 @@ class Board(object):
     is_legal(move)
         Checks if the spot referenced by int move is available to be taken by a
         player.
+    taken
+        Returns the mask of spots that are no longer available.
     check_won
         Checks to see if a player has won the board.
         Returns winning player if so.
     """
 
     def __init__(self):
-        self.board_status = [0 for i in range(9)]
+        # masks[player - 1] holds the spots taken by player
+        self.masks = [0, 0]
         self.won = 0
 
+    @property
+    def board_status(self):
+        x, o = self.masks
+        return [1 if x >> i & 1 else 2 if o >> i & 1 else 0 for i in range(9)]
+
+    def taken(self):
+        """
+        Returns the mask of spots that are no longer available.
+        """
+        return self.masks[0] | self.masks[1]
+
     def make_move(self, player, move):
-        if self.board_status[move] != 0:
+        bit = 1 << move
+        if self.taken() & bit:
             raise InvalidMove
         else:
-            self.board_status[move] = player
-            if self.check_won():
+            mask = self.masks[player - 1] | bit
+            self.masks[player - 1] = mask
+            if WINNING[mask]:
+                self.won = player
                 return (move, True, False)
-            elif self.check_draw():
+            elif self.taken() == FULL:
+                self.won = -1
                 return (move, False, True)
             else:
                 return (move, False, False)
 
     def is_legal(self, move):
-        return self.board_status[move] == 0
+        return not self.taken() >> move & 1
+
+    def check_lines(self, lines):
+        for line in lines:
+            for player in (1, 2):
+                if self.masks[player - 1] & line == line:
+                    return player
 
     def check_rows(self):
-        for i in range(3):
-            row = i * 3
-            if (
-                self.board_status[row]
-                == self.board_status[row + 1]
-                == self.board_status[row + 2]
-                and self.board_status[row] != 0
-            ):
-                return self.board_status[row]
+        return self.check_lines(ROWS)
 
     def check_columns(self):
-        for i in range(3):
-            if (
-                self.board_status[i]
-                == self.board_status[i + 3]
-                == self.board_status[i + 6]
-                and self.board_status[i] != 0
-            ):
-                return self.board_status[i]
+        return self.check_lines(COLUMNS)
 
     def check_diags(self):
-        if (
-            self.board_status[0] == self.board_status[4] == self.board_status[8]
-            and self.board_status[0] != 0
-        ):
-            return self.board_status[0]
-        if (
-            self.board_status[2] == self.board_status[4] == self.board_status[6]
-            and self.board_status[2] != 0
-        ):
-            return self.board_status[2]
+        return self.check_lines(DIAGS)
 
     def check_won(self):
-        rows, cols, diags = self.check_rows(), self.check_columns(), self.check_diags()
-        if rows:
-            self.won = rows
-            return True
-        if cols:
-            self.won = cols
-            return True
-        if diags:
-            self.won = diags
-            return True
+        for player in (1, 2):
+            if WINNING[self.masks[player - 1]]:
+                self.won = player
+                return True
         return False
 
     # Returns true iff the board is completely full and no player has won
     def check_draw(self):
         if not self.check_won():
-            for i in range(9):
-                if self.board_status[i] == 0:
-                    return False
+            if self.taken() != FULL:
+                return False
             self.won = -1
             return True
         return False
@@ -132,8 +168,14 @@ class BigBoard(Board):
     ----------
     boards : Board list
         a list of the subboards that make up the ultimate tic-tac-toe board
+    masks : int list
+        two 9-bit masks, masks[player - 1] having bit i set iff player has
+        won subboard i
+    drawn : int
+        a 9-bit mask of the subboards that ended in a draw
     board_status : int list
-        a list of ints representing the won status of the subboards
+        a list of ints representing the won status of the subboards, built
+        from masks and drawn on access
         Ex. if board_status[0] = 1, then player 1 has won board 0
     prev_move : 3-int tuple of the form (big, small, player_number) with
         big representing the subboard and small representing the spot on the
@@ -142,7 +184,20 @@ class BigBoard(Board):
     won : int
         an integer representing which player has won the ultimate tic-tac-toe
         game (0 meaning still in progress, -1 meaning all squares are full with
-        no winner (ie. a draw))
+        no winner (ie. a draw)), kept up to date by make_move
+    free : int
+        an 81-bit mask of the empty spots of the subboards still in play
+    legal : int
+        an 81-bit mask of the moves the next player may make: the free spots
+        of the forced subboard, or all free spots if there is none. free and
+        legal are updated by make_move
+    history : tuple list
+        one (prev_move, won, zobrist, free) entry per move made with push,
+        holding what pop needs to take that move back
+    zobrist : int
+        a 64-bit Zobrist hash of the position (spots taken, the subboard the
+        next move is forced into and the player to move), updated with every
+        move
 
     Methods
     -------
@@ -152,6 +207,17 @@ class BigBoard(Board):
         by checking if moves are legal to begin with.
         Returns the spot taken (which will be the next big board used in
         ultimate tic-tac-toe)
+    next_player()
+        Returns the player whose turn it is.
+    forced_board()
+        Returns the subboard the next move has to be in, or -1 if any open
+        subboard may be played.
+    push(move, player=None)
+        Makes move like make_move (for whoever is next to play by default) and
+        records it so that it can be taken back.
+    pop()
+        Takes back the last move made with push, restoring the board exactly.
+        Returns that move.
     is_legal(move)
         Checks if the spot referenced by int move is available to be taken by a
         player.
@@ -163,21 +229,105 @@ class BigBoard(Board):
     def __init__(self, subboards):
         super(BigBoard, self).__init__()
         self.boards = subboards
+        self.drawn = 0
         self.prev_move = (-1, -1, 1)
+        self.history = []
+        self._zobrist = FORCED_KEYS[0]
+        self.free = 0
+        for big, board in enumerate(subboards):
+            if board.won == 0:
+                self.free |= (FULL ^ board.taken()) << 9 * big
+        self.legal = self.free
+
+    @property
+    def zobrist(self):
+        return self._zobrist
+
+    def _update_legal(self):
+        forced = self.forced_board()
+        if forced == -1:
+            self.legal = self.free
+        else:
+            self.legal = self.free & SUBBOARD_BITS[forced]
+
+    @property
+    def board_status(self):
+        x, o = self.masks
+        return [
+            1 if x >> i & 1 else 2 if o >> i & 1 else -1 if self.drawn >> i & 1 else 0
+            for i in range(9)
+        ]
+
+    def taken(self):
+        return self.masks[0] | self.masks[1] | self.drawn
 
     def make_move(self, player, move):
         big, small = move
         if self.boards[big].won == 0:
+            forced = self.forced_board()
+            side = self.next_player()
             move, did_win, is_draw = self.boards[big].make_move(player, small)
+            self.free ^= 1 << big * 9 + small
             if did_win:
-                self.board_status[big] = player
+                self.masks[player - 1] |= 1 << big
+                if WINNING[self.masks[player - 1]]:
+                    self.won = player
             elif is_draw:
-                self.board_status[big] = -1
+                self.drawn |= 1 << big
+            if did_win or is_draw:
+                self.free &= ~SUBBOARD_BITS[big]
+            if self.won == 0 and self.taken() == FULL:
+                self.won = -1
             self.prev_move = (big, small, player)
+            self._update_legal()
+            self._zobrist ^= (
+                CELL_KEYS[player - 1][big * 9 + small]
+                ^ FORCED_KEYS[forced + 1]
+                ^ FORCED_KEYS[self.forced_board() + 1]
+            )
+            if side != self.next_player():
+                self._zobrist ^= SIDE_KEY
             return move
         else:
             raise InvalidMove(move)
 
+    def next_player(self):
+        """
+        Returns the player whose turn it is.
+        """
+        big, _, player = self.prev_move
+        if big == -1:
+            return player
+        return 3 - player
+
+    def forced_board(self):
+        _, big, _ = self.prev_move
+        if big != -1 and self.boards[big].won == 0:
+            return big
+        return -1
+
+    def push(self, move, player=None):
+        if player is None:
+            player = self.next_player()
+        entry = (self.prev_move, self.won, self._zobrist, self.free)
+        self.make_move(player, move)
+        self.history.append(entry)
+
+    def pop(self):
+        big, small, player = self.prev_move
+        self.prev_move, self.won, self._zobrist, self.free = self.history.pop()
+        subboard = self.boards[big]
+        subboard.masks[player - 1] ^= 1 << small
+        if subboard.won != 0:
+            # the move closed the subboard, so reopen it on the big board too
+            subboard.won = 0
+            bit = FULL ^ (1 << big)
+            self.masks[0] &= bit
+            self.masks[1] &= bit
+            self.drawn &= bit
+        self._update_legal()
+        return (big, small)
+
     def is_legal(self, move):
         big, small = move
         if big >= 0 and big < 9 and small >= 0 and small < 9:
@@ -208,27 +358,20 @@ class BigBoard(Board):
         possible actions from current state.
         Returns a list of moves in the form (big, small).
         """
-        _, big, _ = self.prev_move
-        if big != -1 and self.boards[big].won == 0:
-            result = []
-            for i in range(9):
-                if self.boards[big].board_status[i] == 0:
-                    result.append((big, i))
-            return result
-        else:
-            result = []
-            for i in range(9):
-                if self.boards[i].won == 0:
-                    for j in range(9):
-                        if self.boards[i].board_status[j] == 0:
-                            result.append((i, j))
-            return result
+        legal = self.legal
+        big = self.forced_board()
+        if big != -1:
+            return list(MOVES[big][legal >> 9 * big & FULL])
+        result = []
+        for i in SPOTS[FULL ^ self.taken()]:
+            result.extend(MOVES[i][legal >> 9 * i & FULL])
+        return result
 
     def is_game_over(self):
         """
         Returns true if the game is over, false otherwise.
         """
-        return self.check_won() or self.check_draw()
+        return self.won != 0
 
     def game_result(self, player):
         """
@@ -236,9 +379,9 @@ class BigBoard(Board):
         on state corresponding to win,
         tie or a loss.
         """
-        if self.check_draw():
+        if self.won == -1:
             return 0
-        elif self.check_won():
+        elif self.won != 0:
             # if the winner is whoever went last
             if self.won == player:
                 return 1
@@ -0,0 +1,161 @@
+"""
+Training examples kept on disk in shards, so that the dataset is not limited
+by memory. Shard i of a directory is the three files
+
+    shard_<i>.observations.npy   int8 (n, 9, 9, 2)
+    shard_<i>.policies.npy       float32 (n, action_size)
+    shard_<i>.values.npy         float32 (n,)
+
+which np.load can memory-map. ShardWriter fills shards of a fixed number of
+examples and ShardDataset reads them back lazily, one shard at a time.
+"""
+
+import glob
+import os
+
+import numpy as np
+
+PARTS = ("observations", "policies", "values")
+
+
+def shard_path(directory, index, part):
+    return os.path.join(directory, "shard_{:05d}.{}.npy".format(index, part))
+
+
+def shard_indices(directory):
+    """
+    Returns the indices of the complete shards in directory, in order.
+    """
+    paths = glob.glob(os.path.join(directory, "shard_*.values.npy"))
+    return sorted(int(os.path.basename(path).split(".")[0][6:]) for path in paths)
+
+
+class ShardWriter:
+    """
+    Appends training examples to the shards of a directory, numbering new
+    shards after the ones already there.
+
+    Examples are gathered in memory and written out as a shard as soon as
+    shard_size of them are waiting. flush writes whatever is waiting as a
+    smaller shard; it is called by close.
+
+    Attributes
+    ----------
+    directory : str
+        where the shards are written
+    shard_size : int
+        the number of examples in each shard (but those written by flush)
+    shards_written : int
+        the number of shards written by this writer
+
+    Methods
+    -------
+    add(observation, pi, value)
+        Adds one example.
+    add_examples(examples)
+        Adds a list of TrainingExamples (with their rewards assigned).
+    flush()
+        Writes the waiting examples out as a shard.
+    """
+
+    def __init__(self, directory, shard_size=1 << 14, action_size=81):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards_written = 0
+        indices = shard_indices(directory)
+        self.next_index = indices[-1] + 1 if indices else 0
+        self.size = 0
+        self.observations = np.zeros((shard_size, 9, 9, 2), np.int8)
+        self.policies = np.zeros((shard_size, action_size), np.float32)
+        self.values = np.zeros(shard_size, np.float32)
+
+    def add(self, observation, pi, value):
+        i = self.size
+        self.observations[i] = observation
+        self.policies[i] = pi
+        self.values[i] = value
+        self.size += 1
+        if self.size == self.shard_size:
+            self.flush()
+
+    def add_examples(self, examples):
+        for e in examples:
+            self.add(e.observation, e.pi, e.reward)
+
+    def flush(self):
+        if self.size == 0:
+            return
+        arrays = (self.observations, self.policies, self.values)
+        # the values file is written last, so a shard only shows up in
+        # shard_indices once all of it is on disk
+        for part, array in zip(PARTS, arrays):
+            path = shard_path(self.directory, self.next_index, part)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array[: self.size])
+            os.replace(path + ".tmp", path)
+        self.next_index += 1
+        self.shards_written += 1
+        self.size = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardDataset:
+    """
+    The training examples in the shards of a directory, read lazily.
+
+    Shards are memory-mapped, so only the one being read is brought into
+    memory. batches visits the shards in random order and the examples of
+    each shard in random order.
+
+    Attributes
+    ----------
+    directory : str
+        where the shards are read from
+    indices : int list
+        the indices of the shards, found when the dataset is created
+
+    Methods
+    -------
+    shard(i)
+        Returns the memory-mapped (observations, policies, values) of the
+        i-th shard.
+    batches(batch_size, shuffle)
+        Yields (observations, policies, values) batches covering every
+        example once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.indices = shard_indices(directory)
+
+    def shard(self, i):
+        return tuple(
+            np.load(shard_path(self.directory, self.indices[i], part), mmap_mode="r")
+            for part in PARTS
+        )
+
+    def __len__(self):
+        return sum(len(self.shard(i)[2]) for i in range(len(self.indices)))
+
+    def batches(self, batch_size=32, shuffle=True):
+        order = np.arange(len(self.indices))
+        if shuffle:
+            np.random.shuffle(order)
+        for i in order:
+            observations, policies, values = self.shard(i)
+            rows = np.arange(len(values))
+            if shuffle:
+                np.random.shuffle(rows)
+            for start in range(0, len(rows), batch_size):
+                # sorted rows read the mapped file front to back
+                batch = np.sort(rows[start : start + batch_size])
+                yield observations[batch], policies[batch], values[batch]
@@ -1,12 +1,14 @@
 from board import BigBoard
 from board import Board
-from monte_carlo import MCTSNode
+from monte_carlo import MCTSNode, MCTSSession
 import random
-import copy
+import sys
 
 """
 Put functions for making AI moves up here
 """
+
+
 def random_move(game_board):
     actions_list = game_board.get_legal_actions()
     index = random.randint(0, len(actions_list) - 1)
@@ -14,12 +16,40 @@ def random_move(game_board):
     return action
 
 
-def monte_carlo_move(game_board, player):
-    # copy game board so MC can do it's game tree search on it without affecting actual board
-    game_board2 = copy.deepcopy(game_board)
-    root = MCTSNode(state=game_board2, player_number=player, origin=player)
+def monte_carlo_move(
+    game_board,
+    player,
+    simulations=None,
+    time_limit_ms=None,
+    time_bank=None,
+    session=None,
+    parallel=None,
+    rollouts=1,
+    table=None,
+    stats=False,
+):
+    # with stats, the move comes with the SearchStats of its search (but for
+    # a root-parallel search, which is not instrumented)
+    # split the search across the processes of a RootParallelSearch if given one
+    if parallel is not None:
+        return parallel.best_action(
+            game_board, player, simulations, time_limit_ms, time_bank
+        )
+    # keep searching the tree from the last move if the game has a session
+    if session is not None:
+        return session.best_action(
+            game_board, simulations, time_limit_ms, time_bank, stats
+        )
+    # MC does it's game tree search with push/pop, which leaves the board as it found it
+    root = MCTSNode(
+        state=game_board,
+        player_number=player,
+        origin=player,
+        rollouts=rollouts,
+        table=table,
+    )
     root.want_to_win = player
-    mcts_move = root.best_action()
+    mcts_move = root.best_action(simulations, time_limit_ms, time_bank, stats)
     return mcts_move
 
 
@@ -52,25 +82,30 @@ def take_turn(curr_board, player, move):
 """Basic text-based visualization for the board"""
 
 
-def visualize_board(curr_board):
-    line_len = 0
+def _board_template():
+    # a {big * 9 + small} field per spot, so a board is a single format call
+    lines = []
     for big_row in range(0, 7, 3):
         for small_row in range(0, 7, 3):
-            to_print = "{} | {} | {} || {} | {} | {} || {} | {} | {}".format(
-                curr_board.boards[big_row].board_status[small_row],
-                curr_board.boards[big_row].board_status[small_row + 1],
-                curr_board.boards[big_row].board_status[small_row + 2],
-                curr_board.boards[big_row + 1].board_status[small_row],
-                curr_board.boards[big_row + 1].board_status[small_row + 1],
-                curr_board.boards[big_row + 1].board_status[small_row + 2],
-                curr_board.boards[big_row + 2].board_status[small_row],
-                curr_board.boards[big_row + 2].board_status[small_row + 1],
-                curr_board.boards[big_row + 2].board_status[small_row + 2],
+            lines.append(
+                " || ".join(
+                    " | ".join("{%d}" % (big * 9 + small_row + i) for i in range(3))
+                    for big in range(big_row, big_row + 3)
+                )
             )
-            line_len = len(to_print)
-            print(to_print)
         if big_row != 6:
-            print("=" * line_len)
+            lines.append("=" * len(lines[-1].format(*[0] * 81)))
+    return "\n".join(lines) + "\n"
+
+
+BOARD_TEMPLATE = _board_template()
+
+
+def visualize_board(curr_board):
+    spots = []
+    for board in curr_board.boards:
+        spots.extend(board.board_status)
+    sys.stdout.write(BOARD_TEMPLATE.format(*spots))
 
 
 """
@@ -86,6 +121,7 @@ def sample_game(p2_type=""):
     turn = 1
     subboard = -1
     choosing_board = False
+    session = MCTSSession(2)
     while t_board.won == 0:
         # Interface stuff starts here
         # (in other words, for a nicer look we would change this)
@@ -114,14 +150,15 @@ def sample_game(p2_type=""):
         elif p2_type == "random":
             subboard, move = random_move(t_board)
         elif p2_type == "mcts":
-            subboard, move = monte_carlo_move(t_board, 2)
+            subboard, move = monte_carlo_move(t_board, 2, session=session)
         elif p2_type == "minimax":
             raise NotImplementedError
         elif p2_type == "neural":
             raise NotImplementedError
-    
+
         valid, new_subboard = take_turn(t_board, turn, (subboard, move))
         if valid:
+            session.advance((subboard, move))
             # Handling of which subboard is next happens here
             if new_subboard or new_subboard == 0:
                 subboard = new_subboard
@@ -139,9 +176,13 @@ def sample_game(p2_type=""):
             print("That move is invalid")
     print("The winner is {}".format(t_board.won))
 
+
 def demo():
-    p2_type = input("Enter who you want to play against ('mcts' for Monte Carlo player, 'random' for random player, 'minimax' for minimax player, 'neural' for adversarial neural network player, or anything else for a normal 2-player game):")
+    p2_type = input(
+        "Enter who you want to play against ('mcts' for Monte Carlo player, 'random' for random player, 'minimax' for minimax player, 'neural' for adversarial neural network player, or anything else for a normal 2-player game):"
+    )
     sample_game(p2_type)
 
+
 if __name__ == "__main__":
     demo()
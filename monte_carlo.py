@@ -1,84 +1,865 @@
+import multiprocessing
+import os
+import time
+
 import numpy as np
 
+from batch_rollout import random_playouts
+
+# simulations run by best_action when it is given no budget
+DEFAULT_SIMULATIONS = 10
+
+
+def encode_action(move):
+    """
+    Returns the (big, small) move as a single int, big * 9 + small.
+    """
+    big, small = move
+    return big * 9 + small
+
+
+def decode_action(action):
+    """
+    Returns the int action as a (big, small) move.
+    """
+    return (int(action) // 9, int(action) % 9)
+
+
+class TranspositionTable:
+    """
+    Visit, win and loss counts pooled by position (by the board's Zobrist
+    hash), so that every node of a search reaching the same position through
+    a different move order shares what was learned about it.
+
+    The table has a fixed number of entries, two to a bucket: size rounded
+    down to a power of two (but at least two). A position can only go in the
+    bucket given by the low bits of its hash. When both entries of the bucket
+    are taken, the one with fewer visits is replaced. A key of 0 marks an
+    empty entry.
+
+    Attributes
+    ----------
+    keys : uint64 array
+        the hash of the position in each entry
+    visits : int array
+        the number of rollouts played through each entry's position
+    wins : int array
+        the number of those rollouts won by the searching player
+    losses : int array
+        the number of those rollouts lost by the searching player
+    probes : int
+        the number of positions looked up with lookup
+    hits : int
+        the number of those that were found
+    stores : int
+        the number of positions added
+    replacements : int
+        the number of those that pushed another position out
+
+    Methods
+    -------
+    find(keys)
+        Returns the entry of each of the hashes in keys (-1 if not there).
+    lookup(key)
+        Returns the entry of the hash key (-1 if not there), counting the
+        probe and whether it hit.
+    store(key)
+        Returns the entry of the hash key, adding it if it is not there.
+    hit_rate()
+        Returns the fraction of probes that were hits.
+    """
+
+    def __init__(self, size=1 << 16):
+        buckets = 1
+        while 4 * buckets <= size:
+            buckets *= 2
+        self.bucket_mask = buckets - 1
+        self.keys = np.zeros(2 * buckets, np.uint64)
+        self.visits = np.zeros(2 * buckets, np.int64)
+        self.wins = np.zeros(2 * buckets, np.int64)
+        self.losses = np.zeros(2 * buckets, np.int64)
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def find(self, keys):
+        first = (keys & np.uint64(self.bucket_mask)).astype(np.intp) * 2
+        slots = np.where(
+            self.keys[first] == keys,
+            first,
+            np.where(self.keys[first + 1] == keys, first + 1, -1),
+        )
+        slots[keys == 0] = -1
+        return slots
+
+    def lookup(self, key):
+        first = (int(key) & self.bucket_mask) * 2
+        self.probes += 1
+        if self.keys[first] == key:
+            self.hits += 1
+            return first
+        if self.keys[first + 1] == key:
+            self.hits += 1
+            return first + 1
+        return -1
+
+    def store(self, key):
+        first = (int(key) & self.bucket_mask) * 2
+        if self.keys[first] == key:
+            return first
+        if self.keys[first + 1] == key:
+            return first + 1
+        self.stores += 1
+        if self.keys[first] == 0:
+            slot = first
+        elif self.keys[first + 1] == 0:
+            slot = first + 1
+        else:
+            self.replacements += 1
+            slot = first if self.visits[first] <= self.visits[first + 1] else first + 1
+        self.keys[slot] = key
+        self.visits[slot] = 0
+        self.wins[slot] = 0
+        self.losses[slot] = 0
+        return slot
+
+    def hit_rate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+
+class MCTSTree:
+    """
+    A Monte Carlo search tree stored as a struct of preallocated NumPy arrays
+    with one entry per node, so that running a simulation allocates no Python
+    objects. The arrays double in size whenever they run out of room.
+
+    The children of a node are created together when it is expanded and sit
+    next to each other in the arrays, so UCT selection scores all of them with
+    a few vectorized operations. Node 0 is the root.
+
+    Given a TranspositionTable, every rollout is also counted for the
+    position of each node it went through, and selection values a child by
+    the pooled counts of its position when they cover more rollouts than the
+    child's own. Each new leaf is looked up in the table, so its hit rate is
+    the fraction of new nodes that were transpositions.
+
+    Attributes
+    ----------
+    want_to_win : int
+        the player whose wins and losses are counted
+    rollouts : int
+        the number of random games played from each new leaf, all at once
+        with batch_rollout when there is more than one
+    size : int
+        the number of nodes in use
+    visits : int array
+        the number of rollouts played through each node
+    wins : int array
+        the number of those rollouts won by want_to_win
+    losses : int array
+        the number of those rollouts lost by want_to_win
+    parent : int array
+        the index of each node's parent (-1 for the root)
+    first_child : int array
+        the index of each node's first child (-1 if it is not expanded yet)
+    num_children : int array
+        the number of children of each node
+    action : int array
+        the move (as big * 9 + small) leading to each node
+    player : int array
+        the player to move at each node
+    key : uint64 array
+        the Zobrist hash of each node's position (0 until it is first visited)
+    table : TranspositionTable
+        the table the statistics are pooled in, or None
+
+    Methods
+    -------
+    simulate(board, c, stats)
+        Runs one selection, expansion, rollout and backpropagation pass from
+        the root, with board at the root position. Leaves board at the
+        position the rollout started from. Given a SearchStats, adds the time
+        spent in each phase and what it did to it.
+    root_children()
+        Returns the (move, visits, wins, losses) of each child of the root,
+        most visited first.
+    best_child(node, c)
+        Returns the index of the child of node with the highest UCT value.
+    is_close(node, margin)
+        Checks whether the two best children of node are too close to call.
+    find_child(node, action)
+        Returns the index of the child of node reached by action, or -1.
+    reroot(node)
+        Makes node the root, keeping the statistics of its subtree.
+    """
+
+    ARRAYS = (
+        "visits",
+        "wins",
+        "losses",
+        "parent",
+        "first_child",
+        "num_children",
+        "action",
+        "player",
+        "key",
+    )
+
+    def __init__(
+        self, player_number, want_to_win, capacity=1 << 16, rollouts=1, table=None
+    ):
+        self.want_to_win = want_to_win
+        self.rollouts = rollouts
+        self.table = table
+        self.size = 0
+        self.visits = np.zeros(capacity, np.int32)
+        self.wins = np.zeros(capacity, np.int32)
+        self.losses = np.zeros(capacity, np.int32)
+        self.parent = np.zeros(capacity, np.int32)
+        self.first_child = np.zeros(capacity, np.int32)
+        self.num_children = np.zeros(capacity, np.int32)
+        self.action = np.zeros(capacity, np.int8)
+        self.player = np.zeros(capacity, np.int8)
+        self.key = np.zeros(capacity, np.uint64)
+        root = self.allocate(1)
+        self.parent[root] = -1
+        self.action[root] = -1
+        self.player[root] = player_number
+
+    def allocate(self, n):
+        """
+        Returns the index of the first of n new, unexpanded nodes.
+        """
+        first = self.size
+        if first + n > len(self.visits):
+            self.grow(first + n)
+        self.size = first + n
+        new = slice(first, first + n)
+        self.visits[new] = 0
+        self.wins[new] = 0
+        self.losses[new] = 0
+        self.first_child[new] = -1
+        self.num_children[new] = 0
+        self.key[new] = 0
+        return first
+
+    def grow(self, needed):
+        capacity = len(self.visits)
+        while capacity < needed:
+            capacity *= 2
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(capacity, old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def expand(self, node, board):
+        actions = [encode_action(move) for move in board.get_legal_actions()]
+        first = self.allocate(len(actions))
+        children = slice(first, first + len(actions))
+        self.parent[children] = node
+        self.action[children] = actions
+        self.player[children] = 3 - self.player[node]
+        self.first_child[node] = first
+        self.num_children[node] = len(actions)
+
+    def best_child(self, node, c=1.4):
+        first = self.first_child[node]
+        children = slice(first, first + self.num_children[node])
+        visits = self.visits[children]
+        unvisited = np.flatnonzero(visits == 0)
+        if c and len(unvisited):
+            return first + unvisited[np.random.randint(len(unvisited))]
+        wins, losses, counts = self.wins[children], self.losses[children], visits
+        if self.table is not None:
+            slots = self.table.find(self.key[children])
+            pooled = np.flatnonzero(slots >= 0)
+            slots = slots[pooled]
+            # use the counts of the position wherever they cover more rollouts
+            better = self.table.visits[slots] > visits[pooled]
+            pooled, slots = pooled[better], slots[better]
+            if len(pooled):
+                wins, losses = wins.astype(np.int64), losses.astype(np.int64)
+                counts = visits.astype(np.int64)
+                wins[pooled] = self.table.wins[slots]
+                losses[pooled] = self.table.losses[slots]
+                counts[pooled] = self.table.visits[slots]
+        good = 1 if self.player[node] == self.want_to_win else -1
+        # multiply weights by -1 if it isn't the player we want to win
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = good * (wins - losses) / counts
+            if c:
+                weights += c * np.sqrt(2 * np.log(self.visits[node]) / visits)
+        weights[unvisited] = -np.inf
+        return first + np.argmax(weights)
+
+    def find_child(self, node, action):
+        first = self.first_child[node]
+        if first == -1:
+            return -1
+        matches = np.flatnonzero(
+            self.action[first : first + self.num_children[node]] == action
+        )
+        return first + matches[0] if len(matches) else -1
+
+    def reroot(self, node):
+        size = self.size
+        # the old root points at an extra, never alive, slot past the end
+        parent = np.where(self.parent[:size] == -1, size, self.parent[:size])
+        parent[node] = node
+        alive = np.zeros(size + 1, bool)
+        alive[node] = True
+        # each pass marks one more level of the subtree of node
+        while True:
+            marked = alive[parent]
+            if np.array_equal(marked, alive[:size]):
+                break
+            alive[:size] = marked
+        alive = alive[:size]
+
+        # move the subtree to the front, keeping its order; children are
+        # allocated after their parents, so node ends up at index 0 and every
+        # block of children stays contiguous
+        new_index = np.cumsum(alive) - 1
+        n = int(new_index[-1]) + 1
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            array[:n] = array[:size][alive]
+        self.parent[:n] = new_index[self.parent[:n]]
+        self.parent[0] = -1
+        first_child = self.first_child[:n]
+        expanded = first_child != -1
+        first_child[expanded] = new_index[first_child[expanded]]
+        self.size = n
+
+    def is_close(self, node=0, margin=0.1):
+        if self.num_children[node] < 2:
+            return False
+        first = self.first_child[node]
+        children = slice(first, first + self.num_children[node])
+        visits = self.visits[children]
+        visited = visits > 0
+        if np.count_nonzero(visited) < 2:
+            return True
+        good = 1 if self.player[node] == self.want_to_win else -1
+        values = good * (self.wins[children] - self.losses[children])[visited]
+        values = np.sort(values / visits[visited])
+        return values[-1] - values[-2] < margin
+
+    def rollout(self, board, player):
+        depth = 0
+        while not board.is_game_over():
+            possible_moves = board.get_legal_actions()
+            action = possible_moves[np.random.randint(len(possible_moves))]
+            board.push(action, player)
+            player = 3 - player
+            depth += 1
+        result = board.game_result(self.want_to_win)
+        for _ in range(depth):
+            board.pop()
+        return result, depth
+
+    def backpropagate(self, node, wins, losses, visits=1):
+        table = self.table
+        while node != -1:
+            self.visits[node] += visits
+            self.wins[node] += wins
+            self.losses[node] += losses
+            if table is not None:
+                slot = table.store(self.key[node])
+                table.visits[slot] += visits
+                table.wins[slot] += wins
+                table.losses[slot] += losses
+            node = self.parent[node]
+
+    def simulate(self, board, c=1.4, stats=None):
+        # with stats, the clock is read between phases; without, each phase
+        # only pays for a None check
+        if stats is not None:
+            start = time.perf_counter()
+            depth = len(board.history)
+            expansion = 0.0
+        node = 0
+        if self.visits[0] == 0:
+            self.key[0] = board.zobrist
+        while not board.is_game_over():
+            if self.first_child[node] == -1:
+                if stats is None:
+                    self.expand(node, board)
+                else:
+                    expand_start = time.perf_counter()
+                    self.expand(node, board)
+                    expansion += time.perf_counter() - expand_start
+                    stats.nodes_created += int(self.num_children[node])
+            node = self.best_child(node, c)
+            mover = int(self.player[self.parent[node]])
+            board.push(decode_action(self.action[node]), mover)
+            if self.visits[node] == 0:
+                self.key[node] = board.zobrist
+                if self.table is not None:
+                    self.table.lookup(self.key[node])
+                break
+        if stats is not None:
+            selected = time.perf_counter()
+            stats.selection_time += selected - start - expansion
+            stats.expansion_time += expansion
+            stats.max_depth = max(stats.max_depth, len(board.history) - depth)
+        player = int(self.player[node])
+        if self.rollouts == 1:
+            result, plies = self.rollout(board, player)
+            wins, losses, visits = int(result == 1), int(result == -1), 1
+        else:
+            wins, _, losses, plies = random_playouts(
+                board, player, self.rollouts, self.want_to_win
+            )
+            visits = self.rollouts
+        if stats is not None:
+            rolled_out = time.perf_counter()
+            stats.rollout_time += rolled_out - selected
+            stats.rollouts += visits
+            stats.rollout_plies += plies
+        self.backpropagate(node, wins, losses, visits)
+        if stats is not None:
+            stats.backprop_time += time.perf_counter() - rolled_out
+
+    def root_children(self):
+        first = self.first_child[0]
+        if first == -1:
+            return []
+        children = range(first, first + self.num_children[0])
+        rows = [
+            (
+                decode_action(self.action[child]),
+                int(self.visits[child]),
+                int(self.wins[child]),
+                int(self.losses[child]),
+            )
+            for child in children
+        ]
+        return sorted(rows, key=lambda row: -row[1])
+
+
+class TimeBank:
+    """
+    A time budget for a whole game, shared out across the moves of one player.
+
+    Each move gets an equal share of what is left over the moves expected to
+    remain, and may run on for up to extension times that share while the
+    top choices at the root are too close to call.
+
+    Attributes
+    ----------
+    remaining_ms : float
+        the time left in the bank
+    moves_made : int
+        the number of moves the bank has paid for
+    extension : float
+        how many times its share a move may take when the choice is close
+
+    Methods
+    -------
+    budget()
+        Returns the (soft, hard) time limits in milliseconds for the next move.
+    spend(ms)
+        Takes ms off the bank and counts one more move made.
+    """
+
+    # moves one player is expected to make in a game, and the fewest moves
+    # the remaining time is ever spread over
+    EXPECTED_MOVES = 30
+    MIN_MOVES_TO_GO = 5
+
+    def __init__(self, total_ms, extension=2.0):
+        self.remaining_ms = total_ms
+        self.moves_made = 0
+        self.extension = extension
+
+    def budget(self):
+        moves_to_go = max(self.MIN_MOVES_TO_GO, self.EXPECTED_MOVES - self.moves_made)
+        remaining = max(self.remaining_ms, 0.0)
+        share = remaining / moves_to_go
+        return share, min(remaining, share * self.extension)
+
+    def spend(self, ms):
+        self.remaining_ms -= ms
+        self.moves_made += 1
+
+
+class SearchStats:
+    """
+    Where the time of one or more searches went and what they did, filled in
+    by MCTSNode.best_action when asked for.
+
+    Attributes
+    ----------
+    searches : int
+        the number of searches counted
+    simulations : int
+        the number of simulations they ran
+    elapsed : float
+        their wall-clock time in seconds
+    selection_time : float
+        the seconds spent walking down the tree to a new leaf
+    expansion_time : float
+        the seconds spent creating children
+    rollout_time : float
+        the seconds spent playing random games from the new leaves
+    backprop_time : float
+        the seconds spent counting the results back up the tree
+    nodes_created : int
+        the number of nodes added to the tree
+    max_depth : int
+        the most moves below the root a new leaf was
+    rollouts : int
+        the number of random games played
+    rollout_plies : int
+        the number of moves played in them
+    root_children : tuple list
+        the (move, visits, wins, losses) of each child of the root after the
+        last search, most visited first (empty once merged)
+
+    Methods
+    -------
+    simulations_per_second()
+        Returns the simulation rate.
+    average_rollout_length()
+        Returns the average number of moves in a random game.
+    merge(other)
+        Adds the counts of other, another SearchStats, to these.
+    report()
+        Returns the stats as a printable table.
+    """
+
+    PHASES = ("selection", "expansion", "rollout", "backprop")
+
+    def __init__(self):
+        self.searches = 0
+        self.simulations = 0
+        self.elapsed = 0.0
+        self.selection_time = 0.0
+        self.expansion_time = 0.0
+        self.rollout_time = 0.0
+        self.backprop_time = 0.0
+        self.nodes_created = 0
+        self.max_depth = 0
+        self.rollouts = 0
+        self.rollout_plies = 0
+        self.root_children = []
+
+    def simulations_per_second(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.simulations / self.elapsed
+
+    def average_rollout_length(self):
+        if self.rollouts == 0:
+            return 0.0
+        return self.rollout_plies / self.rollouts
+
+    def merge(self, other):
+        for name in (
+            "searches",
+            "simulations",
+            "elapsed",
+            "selection_time",
+            "expansion_time",
+            "rollout_time",
+            "backprop_time",
+            "nodes_created",
+            "rollouts",
+            "rollout_plies",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.max_depth = max(self.max_depth, other.max_depth)
+        # the children of different roots cannot be added up
+        self.root_children = []
+        return self
+
+    def report(self):
+        lines = [
+            "searches: {}  simulations: {}  sims/sec: {:.0f}".format(
+                self.searches, self.simulations, self.simulations_per_second()
+            ),
+            "nodes created: {}  max depth: {}  average rollout length: {:.1f}".format(
+                self.nodes_created, self.max_depth, self.average_rollout_length()
+            ),
+        ]
+        # what is left is the search loop itself, mostly undoing the moves
+        other = self.elapsed
+        for phase in self.PHASES:
+            seconds = getattr(self, phase + "_time")
+            other -= seconds
+            lines.append(self._time_line(phase, seconds))
+        lines.append(self._time_line("other", other))
+        if self.root_children:
+            lines.append("move      visits    wins  losses")
+            for move, visits, wins, losses in self.root_children:
+                lines.append(
+                    "{!s:<8} {:>7} {:>7} {:>7}".format(move, visits, wins, losses)
+                )
+        return "\n".join(lines)
+
+    def _time_line(self, phase, seconds):
+        share = seconds / self.elapsed if self.elapsed else 0.0
+        return "{:<10} {:9.3f} s {:6.1%}".format(phase, seconds, share)
+
 
 class MCTSNode:
     """
     Code for this algorithm inspired by the tutorial given on:
     https://ai-boson.github.io/mcts/
     (Link also listed as a reference in our written report.)
+
+    The root of a search for player_number from the position on state. The
+    tree is kept in an MCTSTree, and state is walked with push/pop, so it is
+    back at its original position when best_action returns. A tree from an
+    earlier search whose root is this position can be passed in to carry on
+    from it. Each simulation plays rollouts random games from its new leaf.
+    A new tree pools its statistics in table, if given a TranspositionTable.
+    After a search, simulations holds the number of simulations it ran.
     """
 
-    def __init__(self, state, player_number, origin, parent=None, parent_action=None):
+    def __init__(self, state, player_number, origin, tree=None, rollouts=1, table=None):
         self.state = state
         self.want_to_win = origin
         self.player_number = player_number
-        self.parent = parent
-        self.parent_action = parent_action
-        self.children = []
-        self.actions = self.state.get_legal_actions()
-        self.wins = 0
-        self.losses = 0
-        self.num_sims = 0
-
-    def expand(self):
-        action = self.actions.pop()
-        next_state = self.state.move_MTCS(self.player_number, action)
-        player = 0
-        if self.player_number == 1:
-            player = 2
-        else:
-            player = 1
-        child = MCTSNode(
-            next_state, player, self.want_to_win, parent=self, parent_action=action
-        )
-        self.children.append(child)
-        return child
-
-    def rollout(self):
-        while not self.state.is_game_over():
-            possible_moves = self.state.get_legal_actions()
-            action = self.choose_move(possible_moves)
-            self.state = self.state.move_MTCS(self.player_number, action)
-        return self.state.game_result(self.player_number)
-
-    def backpropagate(self, result):
-        self.num_sims += 1.0
-        if result == 1:
-            self.wins += 1
-        elif result == -1:
-            self.losses += 1
-        if self.parent:
-            self.parent.backpropagate(result)
-
-    def UCT(self, N, c, good):
-        UCT = good * (self.wins - self.losses / self.num_sims) + c * np.sqrt(
-            (2 * np.log(N) / self.num_sims)
-        )
-        return UCT
+        self.tree = tree
+        self.rollouts = rollouts
+        self.table = table
+        self.simulations = 0
 
-    def best_child(self, c=1.4):
-        good = 1 if self.player_number == self.want_to_win else -1
-        # multiply weights by -1 if it isn't the player we want to win
-        weights = [child.UCT(self.num_sims, c, good) for child in self.children]
-        return self.children[np.argmax(weights)]
-
-    def choose_move(self, possible_moves):
-        # currently random
-        return possible_moves[np.random.randint(len(possible_moves))]
-
-    def simulate(self):
-        curr_node = self
-        while not curr_node.state.is_game_over():
-            if not len(self.actions) == 0:
-                return curr_node.expand()
+    def best_action(
+        self, simulations=None, time_limit_ms=None, time_bank=None, stats=False
+    ):
+        """
+        Searches until the budget runs out and returns the best move found.
+
+        The budget is a number of simulations, a wall-clock limit in
+        milliseconds, a share of a TimeBank, or any mix of them (the search
+        stops at whichever runs out first). With no budget given it runs
+        DEFAULT_SIMULATIONS simulations. At least one simulation always runs.
+
+        With stats, returns the move and the SearchStats of the search.
+        """
+        if simulations is None and time_limit_ms is None and time_bank is None:
+            simulations = DEFAULT_SIMULATIONS
+        soft_ms = hard_ms = time_limit_ms
+        if time_bank is not None:
+            bank_soft_ms, bank_hard_ms = time_bank.budget()
+            if hard_ms is None:
+                soft_ms, hard_ms = bank_soft_ms, bank_hard_ms
             else:
-                curr_node = curr_node.best_child()
-        return curr_node
-
-    def best_action(self):
-        simulations = 10
-        for i in range(simulations):
-            v = self.simulate()
-            reward = v.rollout()
-            v.backpropagate(reward)
-        return self.best_child(c=0.0).parent_action
+                soft_ms = min(soft_ms, bank_soft_ms)
+                hard_ms = min(hard_ms, bank_hard_ms)
+
+        start = time.perf_counter()
+        if self.tree is None:
+            self.tree = MCTSTree(
+                self.player_number,
+                self.want_to_win,
+                rollouts=self.rollouts,
+                table=self.table,
+            )
+        stats = SearchStats() if stats else None
+        depth = len(self.state.history)
+        num_sims = 0
+        while True:
+            self.tree.simulate(self.state, stats=stats)
+            while len(self.state.history) > depth:
+                self.state.pop()
+            num_sims += 1
+            if simulations is not None and num_sims >= simulations:
+                break
+            if hard_ms is not None:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if elapsed_ms >= hard_ms:
+                    break
+                # past the soft limit, only keep going while the choice is close
+                if elapsed_ms >= soft_ms and not self.tree.is_close():
+                    break
+        elapsed = time.perf_counter() - start
+        self.simulations = num_sims
+        if time_bank is not None:
+            time_bank.spend(elapsed * 1000)
+        move = decode_action(self.tree.action[self.tree.best_child(0, c=0.0)])
+        if stats is None:
+            return move
+        stats.searches = 1
+        stats.simulations = num_sims
+        stats.elapsed = elapsed
+        stats.root_children = self.tree.root_children()
+        return move, stats
+
+
+class MCTSSession:
+    """
+    A search for player_number that lasts a whole game, keeping its tree from
+    one move to the next.
+
+    advance has to be called with every move played in the game, by either
+    player. It moves the root down to the child reached by that move, so the
+    statistics gathered for the position reached carry over to the next
+    search instead of being thrown away. A TranspositionTable given as table
+    is shared by every search of the game.
+    """
+
+    def __init__(self, player_number, rollouts=1, table=None):
+        self.player_number = player_number
+        self.rollouts = rollouts
+        self.table = table
+        self.tree = None
+
+    def best_action(
+        self, board, simulations=None, time_limit_ms=None, time_bank=None, stats=False
+    ):
+        if self.tree is not None and self.tree.player[0] != board.next_player():
+            self.tree = None
+        root = MCTSNode(
+            board,
+            self.player_number,
+            self.player_number,
+            self.tree,
+            self.rollouts,
+            self.table,
+        )
+        action = root.best_action(simulations, time_limit_ms, time_bank, stats)
+        self.tree = root.tree
+        return action
+
+    def advance(self, move):
+        if self.tree is None:
+            return
+        child = self.tree.find_child(0, encode_action(move))
+        if child == -1:
+            self.tree = None
+        else:
+            self.tree.reroot(child)
+
+
+def _search_from_root(args):
+    """
+    Runs one root-parallel worker's search. Returns the actions, visits, wins
+    and losses of the root's children and the number of simulations run.
+    """
+    board, player_number, want_to_win, seed, rollouts, simulations, time_limit_ms = args
+    np.random.seed(seed)
+    root = MCTSNode(board, player_number, want_to_win, rollouts=rollouts)
+    root.best_action(simulations, time_limit_ms)
+    tree = root.tree
+    first = tree.first_child[0]
+    children = slice(first, first + tree.num_children[0])
+    return (
+        tree.action[children],
+        tree.visits[children],
+        tree.wins[children],
+        tree.losses[children],
+        root.simulations,
+    )
+
+
+class RootParallelSearch:
+    """
+    Root-parallel MCTS: each of workers processes searches its own tree from
+    the same position with a different seed, and the visit, win and loss
+    counts of the root's children are summed across trees to pick the move.
+
+    The process pool is kept between moves; call close (or use the search as
+    a context manager) to shut it down.
+
+    Attributes
+    ----------
+    workers : int
+        the number of worker processes
+    rollouts : int
+        the number of random games played from each new leaf
+    last_simulations : int
+        the number of simulations run by all workers in the last search (each
+        playing rollouts random games)
+    last_elapsed : float
+        the wall-clock time of the last search in seconds
+
+    Methods
+    -------
+    best_action(board, player_number, simulations, time_limit_ms, time_bank)
+        Like MCTSNode.best_action, with simulations counted per worker.
+    simulations_per_second()
+        Returns the simulation rate of the last search across all workers.
+    """
+
+    def __init__(self, workers=None, seed=None, rollouts=1):
+        self.workers = workers or os.cpu_count()
+        self.rollouts = rollouts
+        self.seed = np.random.randint(2**31) if seed is None else seed
+        self.searches = 0
+        self.last_simulations = 0
+        self.last_elapsed = 0.0
+        self.pool = multiprocessing.Pool(self.workers)
+
+    def best_action(
+        self,
+        board,
+        player_number,
+        simulations=None,
+        time_limit_ms=None,
+        time_bank=None,
+    ):
+        if simulations is None and time_limit_ms is None and time_bank is None:
+            simulations = DEFAULT_SIMULATIONS
+        if time_bank is not None:
+            # the workers cannot tell whether the choice is close, so they
+            # stop at the soft limit
+            soft_ms, _ = time_bank.budget()
+            time_limit_ms = (
+                soft_ms if time_limit_ms is None else min(time_limit_ms, soft_ms)
+            )
+
+        start = time.perf_counter()
+        first_seed = self.seed + self.searches * self.workers
+        jobs = [
+            (
+                board,
+                player_number,
+                player_number,
+                first_seed + i,
+                self.rollouts,
+                simulations,
+                time_limit_ms,
+            )
+            for i in range(self.workers)
+        ]
+        results = self.pool.map(_search_from_root, jobs)
+        self.searches += 1
+
+        visits = np.zeros(81, np.int64)
+        wins = np.zeros(81, np.int64)
+        losses = np.zeros(81, np.int64)
+        for actions, child_visits, child_wins, child_losses, _ in results:
+            visits[actions] += child_visits
+            wins[actions] += child_wins
+            losses[actions] += child_losses
+        visited = np.flatnonzero(visits)
+        values = (wins[visited] - losses[visited]) / visits[visited]
+
+        self.last_simulations = sum(result[-1] for result in results)
+        self.last_elapsed = time.perf_counter() - start
+        if time_bank is not None:
+            time_bank.spend(self.last_elapsed * 1000)
+        return decode_action(visited[np.argmax(values)])
+
+    def simulations_per_second(self):
+        if self.last_elapsed == 0:
+            return 0.0
+        return self.last_simulations / self.last_elapsed
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,18 +1,39 @@
 import random
-from tensorflow.keras import layers, Model, Input, metrics, losses
-import tensorflow as tf
+from collections import OrderedDict
 import numpy as np
 
+from dataset import ShardDataset
+from replay import ReplayBuffer
+from symmetry import ACTION_SOURCE, ACTION_TARGET, augment, canonical_keys
+
 
 def apply_actionmask_to_policy(p, action_mask):
     p_masked = p * action_mask
     if np.sum(p_masked) == 0:
-        p_masked = m
+        # no weight on any legal move, so fall back to uniform over them
+        p_masked = action_mask
     return p_masked / np.sum(p_masked)
 
 
+def apply_actionmask_to_policies(p, action_masks):
+    """
+    apply_actionmask_to_policy for a (N, actions) batch of policies and masks.
+    """
+    p_masked = p * action_masks
+    p_masked = np.where(
+        p_masked.sum(axis=1, keepdims=True) == 0, action_masks, p_masked
+    )
+    return p_masked / p_masked.sum(axis=1, keepdims=True)
+
+
 class NNet:
-    def __init__(self, action_size):
+    def __init__(self, action_size, cache_size=0):
+        # TensorFlow takes seconds to import, so it is only imported by the
+        # methods that need it, once a network is made
+        import tensorflow as tf
+        from tensorflow.keras import layers, Model, Input
+
+        self.action_size = action_size
         x = Input(shape=(9, 9, 2))
         y = layers.Conv2D(18, 3, activation="relu")(x)
         y = layers.Conv2D(18, 3, activation="relu")(y)
@@ -27,28 +48,135 @@ class NNet:
 
         self.nnet.compile(optimizer="adam", loss={"p": entropyLoss, "v": "mse"})
 
-    def predict(self, state):
-        x = state.getObservation()
-        x = np.expand_dims(x, 0)
-        p, v = self.nnet.predict(x, batch_size=1)
+        # a single graph for inference on any number of positions, traced once
+        # thanks to the fixed signature, instead of Keras's predict loop
+        self._infer = tf.function(
+            lambda x: self.nnet(x, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, 9, 9, 2), dtype=tf.float32)],
+        )
+
+        # least recently used (unmasked policy, value) outputs by observation,
+        # holding at most cache_size positions (no cache if 0); symmetric
+        # positions share an entry, kept for their canonical version
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def clear_cache(self):
+        """
+        Drops every cached output, as they no longer hold once the weights
+        change.
+        """
+        self.cache.clear()
+
+    def _evaluate(self, x):
+        """
+        Returns the unmasked policies and the values of the observations in x,
+        taking those it can from the cache.
+        """
+        if not self.cache_size:
+            p, v = self._infer(x)
+            return p.numpy(), v.numpy()[:, 0]
 
-        p = p[0]
-        p = apply_actionmask_to_policy(p, state.getActionMask())
-        return p, v[0][0]
+        keys, symmetries = canonical_keys(x)
+        p = np.empty((len(x), self.action_size), np.float32)
+        v = np.empty(len(x), np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                self.cache.move_to_end(key)
+                p[i] = cached[0][ACTION_TARGET[symmetries[i]]]
+                v[i] = cached[1]
+        self.cache_hits += len(x) - len(missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            new_p, new_v = self._infer(x[missing])
+            p[missing] = new_p.numpy()
+            v[missing] = new_v.numpy()[:, 0]
+            for i in missing:
+                self.cache[keys[i]] = (p[i][ACTION_SOURCE[symmetries[i]]], v[i])
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+                self.cache_evictions += 1
+        return p, v
+
+    def predict_batch(self, states, action_masks=None):
+        """
+        Evaluates many positions in one call. states is either a list of
+        States or, with action_masks given, a (N, 9, 9, 2) array of
+        observations. Returns the (N, actions) masked policies and the (N,)
+        values.
+        """
+        if action_masks is None:
+            x = [s.getObservation() for s in states]
+            action_masks = [s.getActionMask() for s in states]
+        else:
+            x = states
+        p, v = self._evaluate(np.asarray(x, np.float32))
+        p = apply_actionmask_to_policies(p, np.asarray(action_masks))
+        return p, v
+
+    def predict(self, state):
+        p, v = self.predict_batch([state])
+        return p[0], v[0]
 
     @staticmethod
-    def _prepare_examples(examples):
-        X = []
-        pi = []
-        v = []
-        for e in examples:
-            X.append(e.state.getObservation())
-            pi.append(e.pi)
-            v.append(e.reward)
-
-        return np.array(X), [np.array(pi), np.array(v)]
-
-    def train(self, examples):
-        X, y = self._prepare_examples(examples)
-        self.nnet.fit(X, y, batch_size=32, shuffle=True, epochs=3)
+    def _prepare_examples(examples, augment_symmetries=True):
+        if isinstance(examples, ReplayBuffer):
+            X, pi, v = examples.arrays()
+        else:
+            X = []
+            pi = []
+            v = []
+            for e in examples:
+                X.append(e.observation)
+                pi.append(e.pi)
+                v.append(e.reward)
+            X, pi, v = np.array(X), np.array(pi), np.array(v)
+        if augment_symmetries:
+            # every example also teaches its 7 symmetric positions
+            X, pi, v = augment(X, pi, v)
+        return X, [pi, v]
+
+    def _stream(self, dataset, augment_symmetries=True, batch_size=32):
+        """
+        Returns a tf.data pipeline of training batches read from the shards
+        of a ShardDataset by a background thread, ahead of the training steps
+        that use them. Each epoch reshuffles.
+        """
+        import tensorflow as tf
+
+        def batches():
+            for X, pi, v in dataset.batches(batch_size):
+                if augment_symmetries:
+                    X, pi, v = augment(X, pi, v)
+                rows = np.random.permutation(len(X))
+                for start in range(0, len(rows), batch_size):
+                    batch = rows[start : start + batch_size]
+                    yield X[batch].astype(np.float32), (pi[batch], v[batch])
+
+        signature = (
+            tf.TensorSpec(shape=(None, 9, 9, 2), dtype=tf.float32),
+            (
+                tf.TensorSpec(shape=(None, self.action_size), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            ),
+        )
+        stream = tf.data.Dataset.from_generator(batches, output_signature=signature)
+        return stream.prefetch(tf.data.AUTOTUNE)
+
+    def train(self, examples, augment_symmetries=True):
+        if isinstance(examples, ShardDataset):
+            # too many examples to hold at once, so stream them from disk
+            self.nnet.fit(self._stream(examples, augment_symmetries), epochs=3)
+        else:
+            X, y = self._prepare_examples(examples, augment_symmetries)
+            self.nnet.fit(X, y, batch_size=32, shuffle=True, epochs=3)
+        self.clear_cache()
         return self
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    A fixed-size store of training examples held in preallocated NumPy
+    arrays, one row per example. Once full, each new example overwrites the
+    oldest one.
+
+    Attributes
+    ----------
+    capacity : int
+        the most examples the buffer holds
+    size : int
+        the number of examples held
+    observations : int8 array
+        the (capacity, 9, 9, 2) observations the examples were taken from
+    policies : float32 array
+        the (capacity, action_size) improved policies found by MCTS
+    values : float32 array
+        the (capacity,) rewards of the games, from the side of the player to
+        move in each observation
+
+    Methods
+    -------
+    add(observation, pi, value)
+        Stores one example.
+    add_examples(examples)
+        Stores a list of TrainingExamples (with their rewards assigned).
+    sample(n)
+        Returns n examples drawn uniformly at random, with replacement.
+    arrays()
+        Returns the (observations, policies, values) held, oldest first.
+    """
+
+    def __init__(self, capacity, action_size=81):
+        self.capacity = capacity
+        self.size = 0
+        # index of the row the next example is written to
+        self.next = 0
+        self.observations = np.zeros((capacity, 9, 9, 2), np.int8)
+        self.policies = np.zeros((capacity, action_size), np.float32)
+        self.values = np.zeros(capacity, np.float32)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, observation, pi, value):
+        i = self.next
+        self.observations[i] = observation
+        self.policies[i] = pi
+        self.values[i] = value
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_examples(self, examples):
+        for e in examples:
+            self.add(e.observation, e.pi, e.reward)
+
+    def sample(self, n):
+        rows = np.random.randint(self.size, size=n)
+        return self.observations[rows], self.policies[rows], self.values[rows]
+
+    def arrays(self):
+        if self.size < self.capacity:
+            rows = slice(0, self.size)
+            return self.observations[rows], self.policies[rows], self.values[rows]
+        # the buffer has wrapped around, so the oldest example is at next
+        order = np.roll(np.arange(self.capacity), -self.next)
+        return self.observations[order], self.policies[order], self.values[order]
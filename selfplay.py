@@ -0,0 +1,359 @@
+"""
+Self-play for training the network: the State wrapper MCTS searches over, the
+neural-network-guided MCTS, self-play episodes and a pool of processes that
+plays episodes in parallel.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+import typing
+
+import numpy as np
+
+import ultimate_tictactoe_v1
+from neutralnet import NNet
+
+if typing.TYPE_CHECKING:
+    from pettingzoo.utils.env import AECEnv
+
+
+# Game env wrapper for MCTS search
+class State:
+
+    def __init__(self, env: "AECEnv"):
+        self.env = env
+
+    def gameEnded(self):
+        _, _, done, _ = self.env.last()
+        return done
+
+    def gameReward(self):
+        _, reward, _, _ = self.env.last()
+        return reward
+
+    def getActionMask(self):
+        observation, _, _, _ = self.env.last()
+        return observation["action_mask"]
+
+    def getValidActions(self):
+        return np.flatnonzero(self.getActionMask())
+
+    def nextState(self, action):
+        # branch from a light copy of the raw env rather than deepcopying the wrappers
+        new_env = self.env.unwrapped.clone()
+        new_env.step(action)
+        player_changed = self.env.agent_selection != new_env.agent_selection
+        return State(new_env), player_changed
+
+    def getObservation(self):
+        return self.env.observe(self.currentAgent())["observation"]
+
+    def currentAgent(self):
+        return self.env.agent_selection
+
+    def show(self, wait=False):
+        self.env.render()
+        if wait:
+            input("press any key to continue")
+
+    def key(self):
+        # Zobrist hash of the position, kept up to date by the board on every move
+        return self.env.unwrapped.zobrist
+
+    def __eq__(self, x):
+        if not isinstance(x, State):
+            return False
+        # the hash covers the cells, the forced subboard and the player to move
+        return self.key() == x.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __reduce__(self):
+        # pickle the game state alone, not the env and its spaces
+        return (_state_from_snapshot, (self.env.unwrapped.snapshot(),))
+
+
+def _state_from_snapshot(snap):
+    env = ultimate_tictactoe_v1.raw_env()
+    env.reset()
+    env.restore(snap)
+    return State(env)
+
+
+class TrainingExample:
+
+    def __init__(self, observation, agent, pi, reward):
+        # only what training needs: the observation of the agent to move
+        self.observation = observation
+        self.agent = agent
+        self.pi = pi
+        self.reward = reward
+
+
+class MCTSNode:
+
+    def __init__(self, p, q):
+        """
+        Parameters
+        ----------
+        p : policy in this state
+        q : q value of this state
+        """
+        self.p = p
+        self.q = q
+        # n[a] : number of times and action has been performed from this state
+        self.n = np.zeros(len(p))
+        # q_a : q values of states following performing an action a
+        self.q_a = np.zeros(len(p))
+        # vl[a] : number of pending batched searches that went through action a
+        self.vl = np.zeros(len(p))
+
+
+class MCTS:
+
+    def __init__(self, nnet, num_mcts_sims, max_depth=10, batch_size=1):
+        self.nnet = nnet
+        self.nodes = {}
+        self.c_puct = 1.0
+        self.num_mcts_sims = num_mcts_sims
+        self.max_depth = max_depth
+        # number of leaves evaluated together by the network when > 1
+        self.batch_size = batch_size
+
+    def search(self, s):
+        if self.batch_size > 1:
+            for done in range(0, self.num_mcts_sims, self.batch_size):
+                # the last batch only makes up the simulations still to run
+                self._search_batch(s, min(self.batch_size, self.num_mcts_sims - done))
+            return
+        for _ in range(self.num_mcts_sims):
+            self._search(s, self.max_depth)
+
+    def _search(self, s, max_depth):
+        if s.gameEnded():
+            return s.gameReward()
+
+        if s not in self.nodes:
+            p, v = self.nnet.predict(s)
+            self.nodes[s] = MCTSNode(p, v)
+            return v
+
+        node = self.nodes[s]
+
+        if max_depth == 0:
+            # max depth reached, returning a heuristic value of this state
+            return node.q
+
+        # upper confidence bound
+        ucb = node.q_a + self.c_puct * node.p * np.sqrt(np.sum(node.n)) / (1 + node.n)
+        ucb[s.getActionMask() == 0] = -np.inf
+        # choose best action based on ucb
+        a = np.argmax(ucb)
+
+        sp, player_changed = s.nextState(a)
+        v = self._search(sp, max_depth - 1)
+        if player_changed:
+            v = -v
+
+        node.q_a[a] = (node.n[a] * node.q_a[a] + v) / (node.n[a] + 1)
+        node.n[a] += 1
+        return v
+
+    def _search_batch(self, s, n):
+        # descend n paths, each one adding a virtual loss to the actions it
+        # takes so the next paths spread out instead of repeating it
+        leaves = {}  # unexpanded leaf -> paths that reached it
+        values = []  # (path, v) for paths that ended with a known value
+        for _ in range(n):
+            path, leaf, v = self._select(s)
+            if v is None:
+                leaves.setdefault(leaf, []).append(path)
+            else:
+                values.append((path, v))
+
+        # evaluate every new leaf in a single forward pass
+        if leaves:
+            states = list(leaves)
+            p, v = self.nnet.predict_batch(states)
+            for i, leaf in enumerate(states):
+                self.nodes[leaf] = MCTSNode(p[i], v[i])
+                values += [(path, v[i]) for path in leaves[leaf]]
+
+        for path, v in values:
+            self._backup(path, v)
+
+    def _select(self, s):
+        # returns the path taken from s, where it ended and the value there (None
+        # if it ended on a leaf that still needs to be evaluated)
+        path = []
+        for max_depth in range(self.max_depth, -1, -1):
+            if s.gameEnded():
+                return path, s, s.gameReward()
+            if s not in self.nodes:
+                return path, s, None
+            node = self.nodes[s]
+            if max_depth == 0:
+                # max depth reached, returning a heuristic value of this state
+                return path, s, node.q
+
+            # upper confidence bound, counting each virtual loss as a lost visit
+            n = node.n + node.vl
+            q_a = (node.n * node.q_a - node.vl) / np.maximum(n, 1)
+            ucb = q_a + self.c_puct * node.p * np.sqrt(np.sum(n)) / (1 + n)
+            ucb[s.getActionMask() == 0] = -np.inf
+            a = np.argmax(ucb)
+
+            node.vl[a] += 1
+            sp, player_changed = s.nextState(a)
+            path.append((node, a, player_changed))
+            s = sp
+
+    def _backup(self, path, v):
+        for node, a, player_changed in reversed(path):
+            if player_changed:
+                v = -v
+            node.q_a[a] = (node.n[a] * node.q_a[a] + v) / (node.n[a] + 1)
+            node.n[a] += 1
+            node.vl[a] -= 1
+
+    # improved policy
+    def pi(self, s: State):
+        node = self.nodes[s]
+        n_sum = np.sum(node.n)
+        if n_sum == 0:
+            return node.p
+
+        return node.n / n_sum
+
+
+def executeSelfPlayEpisode(env: "AECEnv", nnet, num_mcts_sims=3, batch_size=1):
+    examples = []
+    env.reset()
+    s = State(env)
+    # s.show(wait = False)
+    mcts = MCTS(nnet, num_mcts_sims, batch_size=batch_size)
+
+    while True:
+        mcts.search(s)
+        pi = mcts.pi(s)
+        # rewards can not be determined yet
+        examples.append(
+            TrainingExample(s.getObservation().copy(), s.currentAgent(), pi, None)
+        )
+        a = np.random.choice(len(pi), p=pi)  # sample action from improved policy
+        s, _ = s.nextState(a)
+        # s.show(wait = False)
+        if s.gameEnded():
+            examples = assignRewards(examples, s.gameReward(), s.currentAgent())
+            return examples
+
+
+def assignRewards(examples, reward, player_w_reward):
+    for e in examples:
+        e.reward = reward if e.agent == player_w_reward else -reward
+
+    return examples
+
+
+# the network of a SelfPlayPool worker process, the version of the weights it
+# holds and the directory the pool saves the weights of each version to
+_worker_nnet = None
+_worker_version = None
+_weights_dir = None
+
+
+def _weights_path(weights_dir, version):
+    return os.path.join(weights_dir, "weights-{}.npz".format(version))
+
+
+def _init_worker(action_size, cache_size, weights_dir):
+    global _worker_nnet, _weights_dir
+    _worker_nnet = NNet(action_size, cache_size)
+    _weights_dir = weights_dir
+
+
+def _play_episode(args):
+    """
+    Plays one self-play episode in a SelfPlayPool worker, first loading the
+    weights of the version it is given if they are not the ones it has.
+    """
+    global _worker_version
+    version, num_mcts_sims, batch_size, seed = args
+    if version != _worker_version:
+        with np.load(_weights_path(_weights_dir, version)) as f:
+            weights = [f["arr_{}".format(i)] for i in range(len(f.files))]
+        _worker_nnet.nnet.set_weights(weights)
+        _worker_nnet.clear_cache()
+        _worker_version = version
+    np.random.seed(seed)
+    env = ultimate_tictactoe_v1.env()
+    return executeSelfPlayEpisode(env, _worker_nnet, num_mcts_sims, batch_size)
+
+
+class SelfPlayPool:
+    """
+    Plays self-play episodes in a pool of worker processes, each holding its
+    own copy of the network. The pool is started with the spawn method, as
+    TensorFlow cannot be used in forked processes, and is kept until close
+    is called (or the pool is left as a context manager). The weights are
+    saved once per call to play, to a file in a temporary directory the
+    workers load them from, so only the version goes with each episode.
+
+    Attributes
+    ----------
+    workers : int
+        the number of worker processes
+    episodes_played : int
+        the number of episodes handed out to the workers so far
+
+    Methods
+    -------
+    play(nnet, num_eps, num_mcts_sims, batch_size)
+        Yields the examples of each of num_eps episodes as soon as it ends.
+    """
+
+    def __init__(self, workers=None, action_size=81, cache_size=0, seed=None):
+        self.workers = workers or os.cpu_count()
+        self.seed = np.random.randint(2**31) if seed is None else seed
+        self.episodes_played = 0
+        self.version = 0
+        context = multiprocessing.get_context("spawn")
+        self.weights_dir = tempfile.TemporaryDirectory(prefix="selfplay-")
+        self.pool = context.Pool(
+            self.workers,
+            _init_worker,
+            (action_size, cache_size, self.weights_dir.name),
+        )
+
+    def play(self, nnet, num_eps, num_mcts_sims=3, batch_size=1):
+        # every call saves the current weights once, and each worker loads
+        # them before its first episode of this version. The files are kept
+        # until close, as episodes of a call left early may still be queued
+        self.version += 1
+        path = _weights_path(self.weights_dir.name, self.version)
+        np.savez(path, *nnet.nnet.get_weights())
+        jobs = [
+            (
+                self.version,
+                num_mcts_sims,
+                batch_size,
+                self.seed + self.episodes_played + i,
+            )
+            for i in range(num_eps)
+        ]
+        self.episodes_played += num_eps
+        yield from self.pool.imap_unordered(_play_episode, jobs)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.weights_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
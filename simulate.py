@@ -1,9 +1,15 @@
 from board import BigBoard
 from board import Board
 from game import *
-from monte_carlo import MCTSNode
+from monte_carlo import (
+    MCTSNode,
+    MCTSSession,
+    RootParallelSearch,
+    SearchStats,
+    TimeBank,
+    TranspositionTable,
+)
 import random
-import copy
 
 """
 Just so I can put a random player vs. Monte Carlo Player and compare
@@ -16,14 +22,43 @@ def make_random_move(player_number, game_board):
     index = random.randint(0, len(actions_list) - 1)
     action = actions_list[index]
     game_board.make_move(player_number, action)
+    return action
 
 
-def monte_carlo_move(game_board, player):
-    # copy game board so MC can do it's game tree search on it without affecting actual board
-    game_board2 = copy.deepcopy(game_board)
-    root = MCTSNode(state=game_board2, player_number=player, origin=player)
+def monte_carlo_move(
+    game_board,
+    player,
+    simulations=None,
+    time_limit_ms=None,
+    time_bank=None,
+    session=None,
+    parallel=None,
+    rollouts=1,
+    table=None,
+    stats=False,
+):
+    # with stats, the move comes with the SearchStats of its search (but for
+    # a root-parallel search, which is not instrumented)
+    # split the search across the processes of a RootParallelSearch if given one
+    if parallel is not None:
+        return parallel.best_action(
+            game_board, player, simulations, time_limit_ms, time_bank
+        )
+    # keep searching the tree from the last move if the game has a session
+    if session is not None:
+        return session.best_action(
+            game_board, simulations, time_limit_ms, time_bank, stats
+        )
+    # MC does it's game tree search with push/pop, which leaves the board as it found it
+    root = MCTSNode(
+        state=game_board,
+        player_number=player,
+        origin=player,
+        rollouts=rollouts,
+        table=table,
+    )
     root.want_to_win = player
-    mcts_move = root.best_action()
+    mcts_move = root.best_action(simulations, time_limit_ms, time_bank, stats)
     return mcts_move
 
 
@@ -31,47 +66,147 @@ def monte_carlo_move(game_board, player):
 Simulates num_games games of p1 vs. p2 and outputs win/draw percentages.
 p1_type and p2_type (for now) are either "Random" for random player or "MCTS" for 
 Monte Carlo player.
+The Monte Carlo players search for simulations simulations and/or time_limit_ms
+milliseconds per move, and/or share out a bank of time_bank_ms milliseconds per
+game across their moves (see MCTSNode.best_action).
+With reuse_tree they keep their search tree from one move to the next (see
+MCTSSession). With workers they instead run a root-parallel search across that
+many processes (see RootParallelSearch), with simulations counted per worker,
+and the average simulation rate is printed.
+Each Monte Carlo simulation plays rollouts random games from its new leaf.
+With table_size each Monte Carlo player pools its statistics by position in a
+TranspositionTable of at most that many entries (rounded down to a power of
+two), kept for the whole game, and the table hit rate is printed.
+With stats the searches of each Monte Carlo player are timed and counted (see
+SearchStats), and the totals over all games are printed. Root-parallel
+searches are not instrumented, so stats is ignored with workers.
 """
 
 
-def simulate(num_games, p1_type, p2_type):
+def simulate(
+    num_games,
+    p1_type,
+    p2_type,
+    simulations=None,
+    time_limit_ms=None,
+    time_bank_ms=None,
+    reuse_tree=True,
+    workers=None,
+    rollouts=1,
+    table_size=None,
+    stats=False,
+):
+    parallel = None
+    if workers is not None:
+        parallel = RootParallelSearch(workers, rollouts=rollouts)
+        reuse_tree = False
+        stats = False
+    search_stats = {1: SearchStats(), 2: SearchStats()}
+    search_sims = 0
+    search_time = 0.0
+    table_probes = 0
+    table_hits = 0
     p1_win_count = 0
     p2_win_count = 0
     draw_count = 0
 
-    # need try except block because some runs of montecarlo give a value error
-    # due to self.children being empty in the one case I can't figure out
-    # other than that, (in the games where montecarlo works) it wins about 96%
-    # and ties 4% of the time
-    i = 0
-    while i < num_games:
-        i += 1
-        game_board = create_board()
-        turn = 1
-        while not game_board.is_game_over():
-            # p1 move
-            if turn == 1:
-                if p1_type == "Random":
-                    make_random_move(player_number=1, game_board=game_board)
+    try:
+        # need try except block because some runs of montecarlo give a value error
+        # due to self.children being empty in the one case I can't figure out
+        # other than that, (in the games where montecarlo works) it wins about 96%
+        # and ties 4% of the time
+        i = 0
+        while i < num_games:
+            i += 1
+            game_board = create_board()
+            turn = 1
+            time_banks = {1: None, 2: None}
+            if time_bank_ms is not None:
+                time_banks = {1: TimeBank(time_bank_ms), 2: TimeBank(time_bank_ms)}
+            tables = {1: None, 2: None}
+            if table_size is not None:
+                tables = {
+                    1: TranspositionTable(table_size),
+                    2: TranspositionTable(table_size),
+                }
+            sessions = {1: None, 2: None}
+            if reuse_tree:
+                sessions = {
+                    1: MCTSSession(1, rollouts, tables[1]),
+                    2: MCTSSession(2, rollouts, tables[2]),
+                }
+            while not game_board.is_game_over():
+                # p1 move
+                if turn == 1:
+                    if p1_type == "Random":
+                        action = make_random_move(
+                            player_number=1, game_board=game_board
+                        )
+                    else:
+                        action = monte_carlo_move(
+                            game_board,
+                            1,
+                            simulations,
+                            time_limit_ms,
+                            time_banks[1],
+                            sessions[1],
+                            parallel,
+                            rollouts,
+                            tables[1],
+                            stats,
+                        )
+                        if stats:
+                            action, move_stats = action
+                            search_stats[1].merge(move_stats)
+                        game_board.make_move(1, action)
+                        if parallel is not None:
+                            search_sims += parallel.last_simulations
+                            search_time += parallel.last_elapsed
+                    turn = 2
+                # p2 move
                 else:
-                    action = monte_carlo_move(game_board, 1)
-                    game_board.make_move(1, action)
-                turn = 2
-            # p2 move
-            else:
-                if p2_type == "Random":
-                    make_random_move(player_number=2, game_board=game_board)
-                else:
-                    action = monte_carlo_move(game_board, 2)
-                    game_board.make_move(2, action)
-                turn = 1
+                    if p2_type == "Random":
+                        action = make_random_move(
+                            player_number=2, game_board=game_board
+                        )
+                    else:
+                        action = monte_carlo_move(
+                            game_board,
+                            2,
+                            simulations,
+                            time_limit_ms,
+                            time_banks[2],
+                            sessions[2],
+                            parallel,
+                            rollouts,
+                            tables[2],
+                            stats,
+                        )
+                        if stats:
+                            action, move_stats = action
+                            search_stats[2].merge(move_stats)
+                        game_board.make_move(2, action)
+                        if parallel is not None:
+                            search_sims += parallel.last_simulations
+                            search_time += parallel.last_elapsed
+                    turn = 1
+                if reuse_tree:
+                    sessions[1].advance(action)
+                    sessions[2].advance(action)
+            for table in tables.values():
+                if table is not None:
+                    table_probes += table.probes
+                    table_hits += table.hits
 
-        if game_board.won == 2:
-            p2_win_count += 1
-        elif game_board.won == -1:
-            draw_count += 1
-        else:
-            p1_win_count += 1
+            if game_board.won == 2:
+                p2_win_count += 1
+            elif game_board.won == -1:
+                draw_count += 1
+            else:
+                p1_win_count += 1
+    finally:
+        if parallel is not None:
+            parallel.close()
 
     print("=" * 50)
     print(p1_type + " vs. " + p2_type + " Win Pcts")
@@ -79,6 +214,17 @@ def simulate(num_games, p1_type, p2_type):
     print("P1 (" + p1_type + ") Win %: ", p1_win_count / num_games)
     print("P2 (" + p2_type + ") Win %: ", p2_win_count / num_games)
     print("Draw %: ", draw_count / num_games)
+    if parallel is not None and search_time > 0:
+        print(
+            "MCTS sims/sec (" + str(workers) + " workers): ",
+            search_sims / search_time,
+        )
+    if table_probes > 0:
+        print("Transposition table hit rate: ", table_hits / table_probes)
+    for player, player_type in ((1, p1_type), (2, p2_type)):
+        if search_stats[player].searches:
+            print("P" + str(player) + " (" + player_type + ") search stats:")
+            print(search_stats[player].report())
     print("=" * 50)
 
 
@@ -0,0 +1,67 @@
+"""
+The 8 symmetries of the ultimate tic-tac-toe board (4 rotations, each with or
+without a reflection). A symmetry moves the subboards around the big board
+and the spots around every subboard in the same way, so it maps the (9, 9, 2)
+observation of raw_env (indexed [subboard, spot, plane]) and the 81 actions
+(subboard * 9 + spot) onto those of an equivalent position.
+
+Symmetries are applied by gathering: transformed[..., i] = original[..., j]
+with j = ACTION_SOURCE[k][i], and ACTION_TARGET[k] undoes symmetry k.
+"""
+
+import numpy as np
+
+_GRID = np.arange(9).reshape(3, 3)
+
+# SOURCE[k][i] is the spot of a 3x3 board that symmetry k moves onto spot i
+SOURCE = np.array(
+    [np.rot90(grid, turns).ravel() for grid in (_GRID, _GRID.T) for turns in range(4)]
+)
+# the same for the 81 actions, moving subboards and spots together
+ACTION_SOURCE = (SOURCE[:, :, None] * 9 + SOURCE[:, None, :]).reshape(8, 81)
+ACTION_TARGET = np.argsort(ACTION_SOURCE, axis=1)
+
+
+def transform_observations(x, k):
+    """
+    Returns the (N, 9, 9, 2) observations x under symmetry k.
+    """
+    return x.reshape(len(x), 81, -1)[:, ACTION_SOURCE[k]].reshape(x.shape)
+
+
+def transform_policies(p, k):
+    """
+    Returns the (N, 81) policies (or action masks) p under symmetry k.
+    """
+    return p[:, ACTION_SOURCE[k]]
+
+
+def canonical_keys(x):
+    """
+    Returns a key for each of the (N, 9, 9, 2) observations x that is the
+    same for all 8 symmetric versions of a position (the smallest of their
+    packed bits), and the symmetry that takes each observation to the version
+    the key was taken from.
+    """
+    planes = x.reshape(len(x), 81, -1)[:, ACTION_SOURCE] != 0
+    packed = np.packbits(planes.reshape(len(x), 8, -1), axis=2)
+    keys = []
+    symmetries = np.empty(len(x), np.intp)
+    for i, versions in enumerate(packed):
+        versions = [version.tobytes() for version in versions]
+        key = min(versions)
+        keys.append(key)
+        symmetries[i] = versions.index(key)
+    return keys, symmetries
+
+
+def augment(x, pi, v):
+    """
+    Returns the training examples (observations x, policies pi, values v)
+    together with their 7 other symmetric versions, all 8 of each example
+    next to each other.
+    """
+    n = len(x)
+    x = x.reshape(n, 81, -1)[:, ACTION_SOURCE].reshape((n * 8,) + x.shape[1:])
+    pi = pi[:, ACTION_SOURCE].reshape(n * 8, -1)
+    return x, pi, np.repeat(v, 8)
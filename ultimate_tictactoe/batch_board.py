@@ -0,0 +1,63 @@
+"""
+The rules of ultimate tic-tac-toe on NumPy arrays, for playing a batch of
+games at once.
+
+A batch of k games is held as
+    cells : (k, 81) int8 array, cells[g, big * 9 + small] being the player
+        on that spot of game g (0 if it is empty)
+    status : (k, 9) int8 array, the won status of each subboard (0 open,
+        1 or 2 won, -1 drawn)
+    forced : (k,) int array, the subboard the next move has to be in (-1 if
+        any open subboard may be played)
+    player : (k,) int8 array, the player to move
+    result : (k,) int8 array, the winner of each game (0 while it is still in
+        progress, -1 for a draw)
+"""
+
+import numpy as np
+
+from .board import LINES
+
+# WINNING[mask] is True iff the spots set in the 9-bit mask hold a full line
+WINNING = np.array(
+    [
+        any(all(mask >> spot & 1 for spot in line) for line in LINES)
+        for mask in range(512)
+    ]
+)
+POWERS = 1 << np.arange(9)
+# CELL_SUBBOARD[i] is the subboard cell i of the flattened board belongs to
+CELL_SUBBOARD = np.repeat(np.arange(9), 9)
+
+
+def legal_masks(cells, status, forced):
+    """
+    Returns the (k, 81) bool array of the legal moves of every game.
+    """
+    legal = (cells == 0) & (status[:, CELL_SUBBOARD] == 0)
+    legal &= (forced[:, None] == -1) | (CELL_SUBBOARD == forced[:, None])
+    return legal
+
+
+def play_moves(cells, status, player, moves):
+    """
+    Plays moves (a (k,) array of cell indices) for player in every game,
+    updating cells and status in place. Returns the (forced, result) arrays
+    for the position reached.
+    """
+    games = np.arange(len(moves))
+    cells[games, moves] = player
+    big, small = np.divmod(moves, 9)
+
+    subboards = cells.reshape(-1, 9, 9)[games, big]
+    sub_won = WINNING[(subboards == player[:, None]) @ POWERS]
+    sub_full = (subboards != 0).all(axis=1)
+    status[games, big] = np.where(sub_won, player, np.where(sub_full, -1, 0))
+
+    # only the subboard just won can complete a line on the big board, and
+    # a line of drawn subboards wins nothing
+    won = WINNING[(status == player[:, None]) @ POWERS] & sub_won
+    drawn = ~won & (status != 0).all(axis=1)
+    result = np.where(won, player, np.where(drawn, -1, 0)).astype(np.int8)
+    forced = np.where(status[games, small] == 0, small, -1)
+    return forced, result
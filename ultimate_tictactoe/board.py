@@ -1,3 +1,44 @@
+import random
+
+# The lines of three spots that win a board, and for each spot the lines
+# through it
+LINES = (
+    (0, 1, 2),
+    (3, 4, 5),
+    (6, 7, 8),
+    (0, 3, 6),
+    (1, 4, 7),
+    (2, 5, 8),
+    (0, 4, 8),
+    (2, 4, 6),
+)
+LINES_THROUGH = tuple(
+    tuple(line for line in LINES if spot in line) for spot in range(9)
+)
+
+# Random 64-bit keys for Zobrist hashing of BigBoard positions: one per agent
+# per spot (indexed subboard * 9 + spot), one per value of next_board (indexed
+# next_board + 1) and one for agent 2 being to move. They are seeded so that
+# hashes agree across processes and runs.
+_random_key = random.Random(0x5EED).getrandbits
+CELL_KEYS = tuple(tuple(_random_key(64) for _ in range(81)) for _ in range(2))
+FORCED_KEYS = tuple(_random_key(64) for _ in range(10))
+SIDE_KEY = _random_key(64)
+
+# Moves are kept as 81-bit masks, bit subboard * 9 + spot standing for a move
+# (the same numbering as the actions). SUBBOARD_BITS[i] covers subboard i, and
+# MOVES[i][mask] is the tuple of moves (i, spot) for the spots set in the
+# 9-bit mask.
+SUBBOARD_BITS = tuple(0x1FF << 9 * i for i in range(9))
+MOVES = tuple(
+    tuple(tuple((i, j) for j in range(9) if mask >> j & 1) for mask in range(512))
+    for i in range(9)
+)
+
+# the symbol drawn for a spot held by no one, agent 1 and agent 2
+SYMBOLS = "-XO"
+
+
 class Board(object):
     """
     A class used to represent a normal tic-tac-toe board
@@ -15,7 +56,9 @@ class Board(object):
     won : int
         an integer representing which player has won the board
         (0 meaning still in progress, -1 meaning all squares are full with no
-        winner (ie. a draw))
+        winner (ie. a draw)), kept up to date by make_move
+    filled : int
+        the number of spots that have been taken
 
     Methods
     -------
@@ -25,6 +68,9 @@ class Board(object):
         by checking if moves are legal to begin with.
         Returns the spot taken (the next big board used in ultimate tic-tac-toe)
         and a bool which indicates whether the board is done.
+    update_won(spot)
+        Updates won after spot has been taken by checking only the lines
+        through it. Returns whether the board is done.
     is_legal(move)
         Checks if the spot referenced by int move is available to be taken by a
         player.
@@ -36,16 +82,32 @@ class Board(object):
     def __init__(self):
         self.board_status = [0 for i in range(9)]
         self.won = 0
+        self.filled = 0
 
     def make_move(self, player, move):
         if self.board_status[move] != 0:
             return
         self.board_status[move] = player
-        if self.check_won() or self.check_draw():
+        self.filled += 1
+        if self.update_won(move):
             return (move, True)
         else:
             return (move, False)
 
+    def update_won(self, spot):
+        status = self.board_status
+        player = status[spot]
+        # a line of drawn subboards does not win the big board
+        if player > 0:
+            for a, b, c in LINES_THROUGH[spot]:
+                if status[a] == status[b] == status[c]:
+                    self.won = player
+                    return True
+        if self.filled == 9:
+            self.won = -1
+            return True
+        return False
+
     def is_legal(self, move):
         return self.board_status[move] == 0
 
@@ -56,7 +118,7 @@ class Board(object):
                 self.board_status[row]
                 == self.board_status[row + 1]
                 == self.board_status[row + 2]
-                and self.board_status[row] != 0
+                and self.board_status[row] > 0
             ):
                 return self.board_status[row]
 
@@ -66,19 +128,19 @@ class Board(object):
                 self.board_status[i]
                 == self.board_status[i + 3]
                 == self.board_status[i + 6]
-                and self.board_status[i] != 0
+                and self.board_status[i] > 0
             ):
                 return self.board_status[i]
 
     def check_diags(self):
         if (
             self.board_status[0] == self.board_status[4] == self.board_status[8]
-            and self.board_status[0] != 0
+            and self.board_status[0] > 0
         ):
             return self.board_status[0]
         if (
             self.board_status[2] == self.board_status[4] == self.board_status[6]
-            and self.board_status[2] != 0
+            and self.board_status[2] > 0
         ):
             return self.board_status[2]
 
@@ -123,7 +185,20 @@ class BigBoard(Board):
     won : int
         an integer representing which player has won the ultimate tic-tac-toe
         game (0 meaning still in progress, -1 meaning all squares are full with
-        no winner (ie. a draw))
+        no winner (ie. a draw)), kept up to date by play_turn. A line of drawn
+        subboards wins nothing, so the game goes on past it
+    free : int
+        an 81-bit mask of the empty spots of the subboards still in play
+    legal : int
+        an 81-bit mask of the moves the next agent may make: the free spots
+        of next_board, or all free spots if any open subboard may be played.
+        free and legal are updated with every move
+    history : tuple list
+        one (subboard, prev_move, next_board, won, zobrist, free) entry per
+        move made with push, holding what pop needs to take that move back
+    zobrist : int
+        a 64-bit Zobrist hash of the position (spots taken, next_board and the
+        agent to move), updated with every move
 
     Methods
     -------
@@ -133,6 +208,23 @@ class BigBoard(Board):
         by checking if moves are legal to begin with.
         Returns the spot taken (which will be the next big board used in
         ultimate tic-tac-toe)
+    next_player()
+        Returns the agent whose turn it is.
+    push(move, agent=None)
+        Plays move like play_turn (for whoever is next to play by default) and
+        records it so that it can be taken back.
+    pop()
+        Takes back the last move made with push, restoring the board exactly.
+        Returns that move.
+    snapshot()
+        Returns the whole position as a tuple of ints and tuples, which
+        nothing else refers to.
+    restore(snap)
+        Puts the board back in the position of a snapshot, in place.
+    notation()
+        Returns the position on one line: the spots of each subboard (- for
+        empty, X or O) with the subboards separated by /, then the agent to
+        move and the subboard it has to play in (* for any).
     is_legal(move)
         Checks if the spot referenced by int move is available to be taken by a
         agent.
@@ -146,25 +238,130 @@ class BigBoard(Board):
         self.boards = [Board() for i in range(9)]
         self.next_board = -1
         self.prev_move = (-1, -1, 1)
+        self.history = []
+        self._zobrist = FORCED_KEYS[0]
+        self.free = self.legal = (1 << 81) - 1
+
+    @property
+    def zobrist(self):
+        return self._zobrist
+
+    def _update_legal(self):
+        if self.next_board == -1:
+            self.legal = self.free
+        else:
+            self.legal = self.free & SUBBOARD_BITS[self.next_board]
 
     def play_turn(self, agent, move):
-        big, small = move
+        # moves may come in as NumPy ints, which cannot shift the 81-bit masks
+        big, small = int(move[0]), int(move[1])
         subboard = big
         if self.next_board != -1:
             subboard = self.next_board
         if self.boards[subboard].won == 0:
+            side = self.next_player()
+            self._zobrist ^= (
+                CELL_KEYS[agent - 1][subboard * 9 + small]
+                ^ FORCED_KEYS[self.next_board + 1]
+            )
             move, finished = self.boards[subboard].make_move(agent, small)
+            self.free ^= 1 << subboard * 9 + small
             if finished:
                 self.board_status[subboard] = self.boards[subboard].won
+                self.filled += 1
+                self.update_won(subboard)
+                self.free &= ~SUBBOARD_BITS[subboard]
             self.prev_move = (big, small, agent)
             if self.boards[move].won == 0:
                 self.next_board = move
-                return
-            self.next_board = -1
+            else:
+                self.next_board = -1
+            self._update_legal()
+            self._zobrist ^= FORCED_KEYS[self.next_board + 1]
+            if side != self.next_player():
+                self._zobrist ^= SIDE_KEY
             return
         else:
             return
 
+    def next_player(self):
+        """
+        Returns the agent whose turn it is.
+        """
+        big, _, agent = self.prev_move
+        if big == -1:
+            return agent
+        return 3 - agent
+
+    def push(self, move, agent=None):
+        if agent is None:
+            agent = self.next_player()
+        big, small = move
+        subboard = big if self.next_board == -1 else self.next_board
+        assert self.is_legal((subboard, small)), "played illegal move"
+        entry = (
+            subboard,
+            self.prev_move,
+            self.next_board,
+            self.won,
+            self._zobrist,
+            self.free,
+        )
+        self.play_turn(agent, move)
+        self.history.append(entry)
+
+    def pop(self):
+        big, small, _ = self.prev_move
+        entry = self.history.pop()
+        subboard, self.prev_move, self.next_board, self.won = entry[:4]
+        self._zobrist, self.free = entry[4:]
+        self._update_legal()
+        board = self.boards[subboard]
+        board.board_status[small] = 0
+        board.filled -= 1
+        if board.won != 0:
+            # the move closed the subboard, so reopen it on the big board too
+            board.won = 0
+            self.board_status[subboard] = 0
+            self.filled -= 1
+        return (big, small)
+
+    def snapshot(self):
+        cells = []
+        for board in self.boards:
+            cells.extend(board.board_status)
+        return (
+            tuple(cells),
+            tuple(self.board_status),
+            self.next_board,
+            self.prev_move,
+            self.won,
+            self._zobrist,
+            tuple(self.history),
+            self.free,
+        )
+
+    def restore(self, snap):
+        cells, status, self.next_board, self.prev_move, self.won = snap[:5]
+        self._zobrist = snap[5]
+        self.history = list(snap[6])
+        self.free = snap[7]
+        self._update_legal()
+        for i, board in enumerate(self.boards):
+            board.board_status[:] = cells[i * 9 : i * 9 + 9]
+            board.won = status[i]
+            board.filled = 9 - board.board_status.count(0)
+        self.board_status[:] = status
+        self.filled = 9 - self.board_status.count(0)
+
+    def notation(self):
+        spots = "/".join(
+            "".join(map(SYMBOLS.__getitem__, board.board_status))
+            for board in self.boards
+        )
+        forced = "*" if self.next_board == -1 else str(self.next_board)
+        return "{} {} {}".format(spots, SYMBOLS[self.next_player()], forced)
+
     def is_legal(self, move):
         big, small = move
         if big >= 0 and big < 9 and small >= 0 and small < 9:
@@ -195,27 +392,20 @@ class BigBoard(Board):
         possible actions from current state.
         Returns a list of moves in the form (big, small).
         """
-        _, big, _ = self.prev_move
-        if big != -1 and self.boards[big].won == 0:
-            result = []
-            for i in range(9):
-                if self.boards[big].board_status[i] == 0:
-                    result.append((big, i))
-            return result
-        else:
-            result = []
-            for i in range(9):
-                if self.boards[i].won == 0:
-                    for j in range(9):
-                        if self.boards[i].board_status[j] == 0:
-                            result.append((i, j))
-            return result
+        legal = self.legal
+        big = self.next_board
+        if big != -1:
+            return list(MOVES[big][legal >> 9 * big & 0x1FF])
+        result = []
+        for i in range(9):
+            result.extend(MOVES[i][legal >> 9 * i & 0x1FF])
+        return result
 
     def is_game_over(self):
         """
         Returns true if the game is over, false otherwise.
         """
-        return self.check_won() or self.check_draw()
+        return self.won != 0
 
     def game_result(self, player):
         """
@@ -223,9 +413,9 @@ class BigBoard(Board):
         on state corresponding to win,
         tie or a loss.
         """
-        if self.check_draw():
+        if self.won == -1:
             return 0
-        elif self.check_won():
+        elif self.won != 0:
             # if the winner is whoever went last
             if self.won == player:
                 return 1
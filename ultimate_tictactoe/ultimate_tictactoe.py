@@ -1,3 +1,5 @@
+import copy
+import sys
 import warnings
 
 import numpy as np
@@ -6,7 +8,39 @@ from gym import spaces
 from pettingzoo import AECEnv
 from pettingzoo.utils import agent_selector, wrappers
 
-from .board import BigBoard
+from .board import SYMBOLS, BigBoard
+
+# the action mask of an agent that is not to move
+NO_MOVES = np.zeros(81, np.int8)
+NO_MOVES.flags.writeable = False
+
+
+def _frame():
+    # the text render draws, with a {subboard * 9 + spot} field per spot, so
+    # a frame is a single format call
+    blank = "||".join(["|".join([" " * 5] * 3)] * 3)
+    lines = []
+    for row in range(9):
+        big, small = divmod(row, 3)
+        lines.append(blank)
+        lines.append(
+            "||".join(
+                "|".join(
+                    "  {%d}  " % ((big * 3 + i) * 9 + small * 3 + j) for j in range(3)
+                )
+                for i in range(3)
+            )
+        )
+        if small < 2:
+            lines.append(blank.replace(" ", "_"))
+        elif big < 2:
+            lines.append(blank.replace(" ", "="))
+        else:
+            lines.append(blank)
+    return "\n".join(lines) + "\n"
+
+
+FRAME = _frame()
 
 
 def env():
@@ -21,7 +55,7 @@ def env():
 
 class raw_env(AECEnv):
     metadata = {
-        "render.modes": ["human"],
+        "render.modes": ["human", "ansi"],
         "name": "ultimate_tictactoe_v1",
         "is_parallelizable": False,
     }
@@ -49,6 +83,7 @@ class raw_env(AECEnv):
         }
 
         self.rewards = {i: 0 for i in self.agents}
+        self._cumulative_rewards = {i: 0 for i in self.agents}
         self.dones = {i: False for i in self.agents}
         self.infos = {
             i: {"legal_moves": [(i, j) for i in range(9) for j in range(9)]}
@@ -58,22 +93,124 @@ class raw_env(AECEnv):
         self._agent_selector = agent_selector(self.agents)
         self.agent_selection = self._agent_selector.reset()
 
-    def observe(self, agent):
-        board_vals = np.array([subboard.board_status for subboard in self.board.boards])
-        cur_player = self.possible_agents.index(agent)
-        opp_player = (cur_player + 1) % 2
-
-        cur_p_board = np.equal(board_vals, cur_player + 1)
-        opp_p_board = np.equal(board_vals, opp_player + 1)
-
-        observation = np.dstack([cur_p_board, opp_p_board]).astype(np.int8)
-        legal_moves = self._legal_moves() if agent == self.agent_selection else []
+        # _planes[big, small, i] is 1 iff agent i has taken that spot and
+        # _mask holds the legal moves of the agent to move, unpacked from the
+        # board's legal mask; both are updated in place with every move
+        self._planes = np.zeros((9, 9, 2), np.int8)
+        self._mask = np.zeros(81, np.int8)
+        self._make_views()
+        self._init_planes()
+
+    def _make_views(self):
+        # read-only views handed out by observe; each agent sees its own spots
+        # in the first plane
+        self._views = {
+            agent: view
+            for agent, view in zip(
+                self.possible_agents, (self._planes[:], self._planes[:, :, ::-1])
+            )
+        }
+        self._mask_view = self._mask[:]
+        for view in (*self._views.values(), self._mask_view):
+            view.flags.writeable = False
+        self._observed = {}
+
+    def _init_planes(self, cells=(0,) * 81):
+        # cells as in a BigBoard snapshot
+        cells = np.array(cells, np.int8).reshape(9, 9, 1)
+        np.equal(cells, (1, 2), out=self._planes, casting="unsafe")
+        self._update_mask()
+
+    def _update_mask(self):
+        legal = np.frombuffer(self.board.legal.to_bytes(11, "little"), np.uint8)
+        self._mask[:] = np.unpackbits(legal, count=81, bitorder="little")
+        self._observed.clear()
+
+    @property
+    def zobrist(self):
+        """
+        A 64-bit hash of the current position, updated in O(1) per move, for
+        caches and transposition tables to key on.
+        """
+        return self.board.zobrist
+
+    def snapshot(self):
+        """
+        Returns the state of the game (the board, the agent to move and the
+        rewards and dones) as a compact tuple that restore can go back to.
+        The agents are those of possible_agents, so an agent already removed
+        by a done step is kept as done with no reward.
+        """
+        return (
+            self.board.snapshot(),
+            self.possible_agents.index(self.agent_selection),
+            tuple(self.rewards.get(agent, 0) for agent in self.possible_agents),
+            tuple(
+                self._cumulative_rewards.get(agent, 0) for agent in self.possible_agents
+            ),
+            tuple(self.dones.get(agent, True) for agent in self.possible_agents),
+        )
 
-        action_mask = np.zeros(81, "int8")
-        for i in legal_moves:
-            action_mask[i] = 1
+    def restore(self, snap):
+        board, selection, rewards, cumulative_rewards, dones = snap
+        self.board.restore(board)
+        # done steps may have removed agents, so start again from all of them
+        self.agents = self.possible_agents[:]
+        self.rewards = dict(zip(self.agents, rewards))
+        self._cumulative_rewards = dict(zip(self.agents, cumulative_rewards))
+        self.dones = dict(zip(self.agents, dones))
+        self.infos = {agent: {} for agent in self.agents}
+        self._skip_agent_selection = None
+        self._select(selection)
+        self._init_planes(board[0])
+
+    def _select(self, selection):
+        # makes self.agents[selection] the agent to move; all agents must be
+        # in play
+        self._agent_selector.reinit(self.agents)
+        self.agent_selection = self._agent_selector.reset()
+        for _ in range(selection):
+            self.agent_selection = self._agent_selector.next()
+
+    def clone(self):
+        """
+        Returns an independent copy of this env, unwrapped. Only the game
+        state is copied; the spaces and metadata are shared.
+        """
+        env = object.__new__(type(self))
+        env.__dict__.update(self.__dict__)
+        env.board = BigBoard()
+        env.board.restore(self.board.snapshot())
+        env.agents = self.agents[:]
+        env.rewards = dict(self.rewards)
+        env._cumulative_rewards = dict(self._cumulative_rewards)
+        env.dones = dict(self.dones)
+        env.infos = {agent: dict(info) for agent, info in self.infos.items()}
+        # copy the selector as it is, as agents may have been removed
+        env._agent_selector = copy.copy(self._agent_selector)
+        env._agent_selector.agent_order = env.agents
+        env._planes = self._planes.copy()
+        env._mask = self._mask.copy()
+        env._make_views()
+        return env
+
+    def __deepcopy__(self, memo):
+        # a plain deepcopy would leave the copy's views pointing at copies of
+        # the planes that step no longer updates
+        return self.clone()
 
-        return {"observation": observation, "action_mask": action_mask}
+    def observe(self, agent):
+        # the observation is built once per move from read-only views of the
+        # planes, so it must be copied to be kept past the next move
+        observed = self._observed.get(agent)
+        if observed is None:
+            if agent == self.agent_selection:
+                action_mask = self._mask_view
+            else:
+                action_mask = NO_MOVES
+            observed = {"observation": self._views[agent], "action_mask": action_mask}
+            self._observed[agent] = observed
+        return observed
 
     def observation_space(self, agent):
         return self.observation_spaces[agent]
@@ -81,29 +218,18 @@ class raw_env(AECEnv):
     def action_space(self, agent):
         return self.action_spaces[agent]
 
-    def _legal_moves(self):
-        big = self.board.next_board
-        if big != -1 and self.board.boards[big].won == 0:
-            result = []
-            for i in range(9):
-                if self.board.boards[big].board_status[i] == 0:
-                    result.append(big * 9 + i)
-            return result
-        else:
-            result = []
-            for i in range(9):
-                if self.board.boards[i].won == 0:
-                    for j in range(9):
-                        if self.board.boards[i].board_status[j] == 0:
-                            result.append(i * 9 + j)
-            return result
-
     def step(self, action):
         if self.dones[self.agent_selection]:
+            self._observed.clear()
             return self._was_done_step(action)
         action = (action // 9, action % 9)
         assert self.board.is_legal(action), "played illegal move"
-        self.board.play_turn(self.agents.index(self.agent_selection) + 1, action)
+        big, small = action
+        if self.board.next_board != -1:
+            big = self.board.next_board
+        agent = self.agents.index(self.agent_selection)
+        self.board.play_turn(agent + 1, action)
+        self._planes[big, small, agent] = 1
 
         next_agent = self._agent_selector.next()
 
@@ -122,6 +248,7 @@ class raw_env(AECEnv):
             self.dones = {i: True for i in self.agents}
         self._cumulative_rewards[self.agent_selection] = 0
         self.agent_selection = next_agent
+        self._update_mask()
 
         self._accumulate_rewards()
 
@@ -136,542 +263,22 @@ class raw_env(AECEnv):
         self._agent_selector.reinit(self.agents)
         self._agent_selector.reset()
         self.agent_selection = self._agent_selector.reset()
+        self._init_planes()
 
     def render(self, mode="human"):
-        def get_symbol(input):
-            if input == 0:
-                return "-"
-            elif input == 1:
-                return "X"
-            else:
-                return "O"
-
-        board = np.array(
-            [subboard.board_status for subboard in self.board.boards]
-        ).flatten()
-        board = list(map(get_symbol, board))
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[0]}  "
-            + "|"
-            + f"  {board[1]}  "
-            + "|"
-            + f"  {board[2]}  "
-            + "||"
-            + f"  {board[9]}  "
-            + "|"
-            + f"  {board[10]}  "
-            + "|"
-            + f"  {board[11]}  "
-            + "||"
-            + f"  {board[18]}  "
-            + "|"
-            + f"  {board[19]}  "
-            + "|"
-            + f"  {board[20]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[3]}  "
-            + "|"
-            + f"  {board[4]}  "
-            + "|"
-            + f"  {board[5]}  "
-            + "||"
-            + f"  {board[12]}  "
-            + "|"
-            + f"  {board[13]}  "
-            + "|"
-            + f"  {board[14]}  "
-            + "||"
-            + f"  {board[21]}  "
-            + "|"
-            + f"  {board[22]}  "
-            + "|"
-            + f"  {board[23]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[6]}  "
-            + "|"
-            + f"  {board[7]}  "
-            + "|"
-            + f"  {board[8]}  "
-            + "||"
-            + f"  {board[15]}  "
-            + "|"
-            + f"  {board[16]}  "
-            + "|"
-            + f"  {board[17]}  "
-            + "||"
-            + f"  {board[24]}  "
-            + "|"
-            + f"  {board[25]}  "
-            + "|"
-            + f"  {board[26]}  "
-        )
-        print(
-            "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "||"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "||"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[27]}  "
-            + "|"
-            + f"  {board[28]}  "
-            + "|"
-            + f"  {board[29]}  "
-            + "||"
-            + f"  {board[36]}  "
-            + "|"
-            + f"  {board[37]}  "
-            + "|"
-            + f"  {board[38]}  "
-            + "||"
-            + f"  {board[45]}  "
-            + "|"
-            + f"  {board[46]}  "
-            + "|"
-            + f"  {board[47]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[30]}  "
-            + "|"
-            + f"  {board[31]}  "
-            + "|"
-            + f"  {board[32]}  "
-            + "||"
-            + f"  {board[39]}  "
-            + "|"
-            + f"  {board[40]}  "
-            + "|"
-            + f"  {board[41]}  "
-            + "||"
-            + f"  {board[48]}  "
-            + "|"
-            + f"  {board[49]}  "
-            + "|"
-            + f"  {board[50]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[33]}  "
-            + "|"
-            + f"  {board[34]}  "
-            + "|"
-            + f"  {board[35]}  "
-            + "||"
-            + f"  {board[42]}  "
-            + "|"
-            + f"  {board[43]}  "
-            + "|"
-            + f"  {board[44]}  "
-            + "||"
-            + f"  {board[51]}  "
-            + "|"
-            + f"  {board[52]}  "
-            + "|"
-            + f"  {board[53]}  "
-        )
-        print(
-            "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "||"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "||"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-            + "|"
-            + "=" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[54]}  "
-            + "|"
-            + f"  {board[55]}  "
-            + "|"
-            + f"  {board[56]}  "
-            + "||"
-            + f"  {board[63]}  "
-            + "|"
-            + f"  {board[64]}  "
-            + "|"
-            + f"  {board[65]}  "
-            + "||"
-            + f"  {board[72]}  "
-            + "|"
-            + f"  {board[73]}  "
-            + "|"
-            + f"  {board[74]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[57]}  "
-            + "|"
-            + f"  {board[58]}  "
-            + "|"
-            + f"  {board[59]}  "
-            + "||"
-            + f"  {board[66]}  "
-            + "|"
-            + f"  {board[67]}  "
-            + "|"
-            + f"  {board[68]}  "
-            + "||"
-            + f"  {board[75]}  "
-            + "|"
-            + f"  {board[76]}  "
-            + "|"
-            + f"  {board[77]}  "
-        )
-        print(
-            "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "||"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-            + "|"
-            + "_" * 5
-        )
-
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
-        print(
-            f"  {board[60]}  "
-            + "|"
-            + f"  {board[61]}  "
-            + "|"
-            + f"  {board[62]}  "
-            + "||"
-            + f"  {board[69]}  "
-            + "|"
-            + f"  {board[70]}  "
-            + "|"
-            + f"  {board[71]}  "
-            + "||"
-            + f"  {board[78]}  "
-            + "|"
-            + f"  {board[79]}  "
-            + "|"
-            + f"  {board[80]}  "
-        )
-        print(
-            " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "||"
-            + " " * 5
-            + "|"
-            + " " * 5
-            + "|"
-            + " " * 5
-        )
+        cells = []
+        for subboard in self.board.boards:
+            cells.extend(subboard.board_status)
+        frame = FRAME.format(*map(SYMBOLS.__getitem__, cells))
+        if mode == "ansi":
+            return frame
+        sys.stdout.write(frame)
+
+    def notation(self):
+        """
+        Returns the position on one line, as BigBoard.notation.
+        """
+        return self.board.notation()
 
     def close(self):
         pass
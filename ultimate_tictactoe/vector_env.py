@@ -0,0 +1,87 @@
+import numpy as np
+
+from .batch_board import legal_masks, play_moves
+
+
+class VectorEnv:
+    """
+    num_envs games of ultimate tic-tac-toe played in lockstep on NumPy arrays,
+    with the rules, observations and rewards of raw_env. A game that ends is
+    started again straight away, so every game always has a move to make.
+
+    Attributes
+    ----------
+    num_envs : int
+        the number of games
+    agents : str list
+        the names of the two agents, player_1 moving first
+    cells : (num_envs, 81) int8 array
+        the agent on each spot of each game (1 or 2, 0 if it is empty),
+        indexed subboard * 9 + spot like the actions
+    status : (num_envs, 9) int8 array
+        the result of each subboard (0 open, 1 or 2 won, -1 drawn)
+    next_board : (num_envs,) int array
+        the subboard the next move has to be in (-1 if any open one)
+    agent_selection : (num_envs,) int array
+        the index in agents of the agent to move in each game
+    action_mask : (num_envs, 81) bool array
+        the legal moves of each game, as of the last observation
+
+    Methods
+    -------
+    reset()
+        Starts every game again. Returns the observations and action masks.
+    step(actions)
+        Plays one move in every game. Returns the observations and action
+        masks of the agents to move next, the (num_envs, 2) rewards of the
+        move for each agent and whether it ended the game.
+    observe()
+        Returns the (num_envs, 9, 9, 2) observations and (num_envs, 81) action
+        masks of the agents to move, as raw_env.observe would.
+    """
+
+    def __init__(self, num_envs):
+        self.num_envs = num_envs
+        self.agents = ["player_1", "player_2"]
+        self.cells = np.zeros((num_envs, 81), np.int8)
+        self.status = np.zeros((num_envs, 9), np.int8)
+        self.next_board = np.full(num_envs, -1)
+        self.agent_selection = np.zeros(num_envs, int)
+        self.action_mask = legal_masks(self.cells, self.status, self.next_board)
+
+    def _reset_games(self, games):
+        self.cells[games] = 0
+        self.status[games] = 0
+        self.next_board[games] = -1
+        self.agent_selection[games] = 0
+
+    def reset(self):
+        self._reset_games(slice(None))
+        return self.observe()
+
+    def observe(self):
+        player = (self.agent_selection + 1)[:, None, None, None]
+        cells = self.cells.reshape(-1, 9, 9, 1)
+        planes = [cells == player, cells == 3 - player]
+        observation = np.concatenate(planes, axis=3).astype(np.int8)
+        self.action_mask = legal_masks(self.cells, self.status, self.next_board)
+        return observation, self.action_mask.astype(np.int8)
+
+    def step(self, actions):
+        games = np.arange(self.num_envs)
+        actions = np.asarray(actions)
+        assert self.action_mask[games, actions].all(), "played illegal move"
+
+        agent = self.agent_selection
+        player = (agent + 1).astype(np.int8)
+        self.next_board, result = play_moves(self.cells, self.status, player, actions)
+        won = result > 0
+        dones = result != 0
+        rewards = np.zeros((self.num_envs, 2))
+        rewards[won, agent[won]] = 1
+        rewards[won, 1 - agent[won]] = -1
+
+        self.agent_selection = 1 - agent
+        self._reset_games(dones)
+        observation, action_mask = self.observe()
+        return observation, action_mask, rewards, dones
@@ -1 +1,11 @@
-from ultimate_tictactoe.ultimate_tictactoe import env, raw_env
+from ultimate_tictactoe.vector_env import VectorEnv
+
+
+def __getattr__(name):
+    # env and raw_env need gym and PettingZoo, which are slow to import, so
+    # they are only imported once one of them is asked for
+    if name in ("env", "raw_env"):
+        from ultimate_tictactoe import ultimate_tictactoe
+
+        return getattr(ultimate_tictactoe, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))